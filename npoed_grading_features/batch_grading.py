@@ -0,0 +1,217 @@
+"""
+Batch grading of many learners of a vertical-graded course at once.
+Input is learners x verticals matrices of earned and possible graded scores;
+category percents with weighted drops, course percent, letter grade and
+passing grade status are computed with numpy operations over learners.
+
+Results are equal to the ones of per-learner path (CourseGrade with
+FlexibleNpoedGrader and passing grade), which is given by grade_learner
+with grading_core: sums are accumulated in the same order, so floats are
+the same bit to bit.
+Only AssignmentFormatGrader categories are supported, as in vertical grading.
+
+Module doesn't depend on django or edx, numpy is needed only for BatchGrader.
+"""
+from __future__ import division
+
+import sys
+
+from .drops import EPSILON, MAX_ITERATIONS
+from .grading_core import GradedItem, GradingPolicy, grade_items
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, per-learner grading doesn't need it
+    np = None
+
+PY2 = sys.version_info[0] == 2
+
+
+def grade_learner(policy, formats, weights, earned, possible, passing_grade=True):
+    """
+    Grades one learner the way per-learner path does. formats and weights
+    are given per vertical, format is None for not graded vertical.
+    Returns dict with category_percents (used for course percent),
+    category_averages (used for passing grade), percent, letter_grade and passed.
+    """
+    items = {}
+    for i, assignment_format in enumerate(formats):
+        # Verticals with zero weight are counted, but don't change weighted average
+        if assignment_format is not None and possible[i] > 0:
+            items.setdefault(assignment_format, []).append(GradedItem(earned[i], possible[i], weights[i]))
+    return grade_items(policy, items, vertical_mode=True, passing_grade=passing_grade)._asdict()
+
+
+class BatchGrader(object):
+    """
+    Grades all learners at once. formats and weights are given per vertical
+    (matrix column), format is None for not graded vertical.
+    """
+    def __init__(self, grading_policy, formats, weights, passing_grade=True):
+        if np is None:
+            raise ImportError("Batch grading requires numpy")
+        self.policy = GradingPolicy(grading_policy)
+        self.formats = list(formats)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.passing_grade = passing_grade
+        if len(self.formats) != len(self.weights):
+            raise ValueError("Formats and weights must have the same length")
+
+    def grade(self, earned, possible):
+        """
+        earned and possible are learners x verticals matrices.
+        Returns dict with the same keys as grade_learner, values are arrays over learners.
+        """
+        earned = np.asarray(earned, dtype=np.float64)
+        possible = np.asarray(possible, dtype=np.float64)
+        if earned.shape != possible.shape or earned.ndim != 2 or earned.shape[1] != len(self.formats):
+            raise ValueError("Earned and possible must be learners x verticals matrices")
+        learners = earned.shape[0]
+
+        category_percents, category_averages = {}, {}
+        total = np.zeros(learners)
+        for category in self.policy.categories:
+            columns = [i for i, x in enumerate(self.formats) if x == category['type']]
+            category_percent, average = self._grade_category(
+                category, earned[:, columns], possible[:, columns], self.weights[columns]
+            )
+            category_percents[category['type']] = category_percent
+            category_averages[category['type']] = average
+            total += category_percent * category['weight']
+
+        percent = _round_array(total * 100 + 0.05) / 100
+        if self.policy.success_cutoff:
+            passed = percent >= self.policy.success_cutoff
+        else:
+            passed = np.zeros(learners, dtype=bool)
+        if self.passing_grade:
+            for category in self.policy.checked_categories():
+                passed &= ~(category_averages[category['type']] < category['passing_grade'])
+
+        letter_grade = np.empty(learners, dtype=object)
+        assigned = np.zeros(learners, dtype=bool)
+        letter_percent = np.where(passed, percent, 0) if self.passing_grade else percent
+        for possible_grade in self.policy.descending_grades:
+            matched = ~assigned & (letter_percent >= self.policy.grade_cutoffs[possible_grade])
+            letter_grade[matched] = possible_grade
+            assigned |= matched
+        return {
+            'category_percents': category_percents,
+            'category_averages': category_averages,
+            'percent': percent,
+            'letter_grade': letter_grade,
+            'passed': passed,
+        }
+
+    def _grade_category(self, category, earned, possible, weights):
+        learners, verticals = earned.shape
+        # Verticals with zero weight are counted, but don't change weighted average
+        present = possible > 0
+        percents = np.where(present, earned / np.where(present, possible, 1.), 0.)
+        counts = present.sum(axis=1)
+        size = np.maximum(counts, category['min_count'])
+
+        average = np.zeros(learners)
+        for column in range(verticals):
+            average += np.where(present[:, column], percents[:, column], 0.)
+        average = np.where(size > 0, average / np.maximum(size, 1), 0.)
+
+        result = np.zeros(learners)
+        single = (counts > 0) & (size == 1)
+        if category['drop_count'] == 0:
+            result[single] = average[single]
+        else:
+            # Grader can't drop the only item and sets it to 0
+            average[single] = 0.
+        rows = np.nonzero((counts > 0) & (size > 1))[0]
+        if len(rows):
+            result[rows] = self._drop_weighted_average(
+                percents[rows], present[rows], np.broadcast_to(weights, present[rows].shape),
+                size[rows] - counts[rows], category['drop_count']
+            )
+        return result, average
+
+    def _drop_weighted_average(self, percents, present, weights, padding, drop_count):
+        """
+        Vectorized drops.drop_weighted_average. Rows are learners; absent
+        verticals are skipped, padding zero items are added after present ones.
+        """
+        learners = percents.shape[0]
+        pad_columns = int(padding.max()) if learners else 0
+        percents = np.hstack([percents, np.zeros((learners, pad_columns))])
+        weights = np.hstack([np.where(present, weights, 0.), np.zeros((learners, pad_columns))])
+        present = np.hstack([present, np.arange(pad_columns)[None, :] < padding[:, None]])
+        size = present.sum(axis=1)
+
+        result = np.zeros(learners)
+        if drop_count == 0:
+            return self._kept_average(percents, weights, present)
+        rows = np.nonzero(size > drop_count)[0]
+        # Learners that drop all items get 0
+        if not len(rows):
+            return result
+        percents, weights, present = percents[rows], weights[rows], present[rows]
+
+        # Start from dropping lowest percents, it is optimal for equal weights
+        dropped = self._smallest(np.where(present, percents, np.inf), drop_count)
+        ratio = self._kept_average(percents, weights, present & ~self._mask(dropped, present.shape))
+        active = np.ones(len(rows), dtype=bool)
+        for _ in range(MAX_ITERATIONS):
+            if not active.any():
+                break
+            values = np.where(present, weights * (percents - ratio[:, None]), np.inf)
+            candidate = self._smallest(values, drop_count)
+            candidate_ratio = self._kept_average(percents, weights, present & ~self._mask(candidate, present.shape))
+            converged = candidate_ratio <= ratio + EPSILON * np.maximum(1., np.abs(ratio))
+            # Same ratio, but deterministic tie-breaking prefers lower indices
+            tie = active & converged & (candidate_ratio >= ratio) & self._less(candidate, dropped)
+            improved = active & ~converged
+            dropped[tie | improved] = candidate[tie | improved]
+            ratio[improved] = candidate_ratio[improved]
+            active &= ~converged
+
+        result[rows] = self._kept_average(percents, weights, present & ~self._mask(dropped, present.shape))
+        return result
+
+    @staticmethod
+    def _smallest(values, count):
+        """
+        Returns sorted columns of count smallest values per row, ties are broken by column
+        """
+        return np.sort(np.argsort(values, axis=1, kind='mergesort')[:, :count], axis=1)
+
+    @staticmethod
+    def _mask(indices, shape):
+        mask = np.zeros(shape, dtype=bool)
+        mask[np.arange(shape[0])[:, None], indices] = True
+        return mask
+
+    @staticmethod
+    def _less(left, right):
+        """
+        Lexicographic comparison of rows of sorted index matrices
+        """
+        differs = left != right
+        first = differs.argmax(axis=1)
+        rows = np.arange(left.shape[0])
+        return differs.any(axis=1) & (left[rows, first] < right[rows, first])
+
+    @staticmethod
+    def _kept_average(percents, weights, kept):
+        top = np.zeros(percents.shape[0])
+        bottom = np.zeros(percents.shape[0])
+        for column in range(percents.shape[1]):
+            top += np.where(kept[:, column], weights[:, column] * percents[:, column], 0.)
+            bottom += np.where(kept[:, column], weights[:, column], 0.)
+        return np.where(bottom > 0, top / np.where(bottom > 0, bottom, 1.), 0.)
+
+
+def _round_array(values):
+    """
+    Same rounding as builtin round: half away from zero at python 2, half to even at python 3
+    """
+    if PY2:
+        # Half away from zero, as builtin round at python 2
+        whole = np.trunc(values)
+        return whole + np.where(np.abs(values - whole) >= 0.5, np.sign(values), 0.)
+    return np.rint(values)
@@ -0,0 +1,57 @@
+"""
+Raw sql helpers for bulk writes that django orm can't express.
+"""
+from django.db import connection
+
+
+def bulk_upsert(model, fields, rows, update_fields):
+    """
+    Inserts rows or updates update_fields of rows that violate unique
+    constraint, with one statement. Rows are tuples of values for fields.
+    Supports mysql, postgresql and sqlite (3.24+).
+    """
+    if not rows:
+        return
+    quote = connection.ops.quote_name
+    update_columns = [quote(model._meta.get_field(name).column) for name in update_fields]
+
+    if connection.vendor == 'mysql':
+        on_conflict = "ON DUPLICATE KEY UPDATE " + ", ".join(
+            "{0} = VALUES({0})".format(column) for column in update_columns
+        )
+    elif connection.vendor in ('postgresql', 'sqlite'):
+        unique_columns = get_unique_columns(model, quote)
+        on_conflict = "ON CONFLICT ({}) DO UPDATE SET ".format(", ".join(unique_columns)) + ", ".join(
+            "{0} = excluded.{0}".format(column) for column in update_columns
+        )
+    else:
+        raise NotImplementedError("Upsert is not supported for '{}' database".format(connection.vendor))
+
+    execute_upsert(model, fields, rows, on_conflict)
+
+
+def execute_upsert(model, fields, rows, on_conflict):
+    """
+    Executes multi-row INSERT of fields with given vendor specific conflict clause.
+    """
+    quote = connection.ops.quote_name
+    model_fields = [model._meta.get_field(name) for name in fields]
+    placeholder = "(" + ", ".join(["%s"] * len(fields)) + ")"
+    sql = "INSERT INTO {table} ({columns}) VALUES {values} {on_conflict}".format(
+        table=quote(model._meta.db_table),
+        columns=", ".join(quote(field.column) for field in model_fields),
+        values=", ".join([placeholder] * len(rows)),
+        on_conflict=on_conflict,
+    )
+    params = []
+    for row in rows:
+        params.extend(field.get_db_prep_save(value, connection) for field, value in zip(model_fields, row))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def get_unique_columns(model, quote):
+    unique_together = model._meta.unique_together
+    if not unique_together:
+        raise ValueError("Model {} has no unique_together constraint".format(model.__name__))
+    return [quote(model._meta.get_field(name).column) for name in unique_together[0]]
@@ -0,0 +1,124 @@
+"""
+Selection of items to drop from weighted average. Module doesn't depend
+on django or edx, so it can be used and benchmarked standalone.
+
+Weighted average G(S) = sum(w[i]p[i]) / sum(w[i]) over kept items S.
+Dropping k items one by one with the best gain is not optimal if weights
+differ, so optimal subset is found with Dinkelbach parametric search: for
+fixed ratio L the best subset of n-k items maximizes sum(w[i](p[i] - L)),
+i.e. keeps n-k items with largest w[i](p[i] - L). Ratio of that subset is
+the next L. L strictly grows until it is optimal, in practice it takes a few
+iterations, each O(n log n).
+"""
+import heapq
+
+MAX_ITERATIONS = 100
+# Relative ratio improvement that is considered as rounding noise
+EPSILON = 1e-12
+
+
+def weighted_average(percents, weights, indices=None):
+    """
+    Returns weighted average of items with given indices (all by default),
+    0 if they have no weight.
+    """
+    if indices is None:
+        indices = range(len(percents))
+    top, bottom = 0., 0.
+    for i in indices:
+        top += weights[i] * percents[i]
+        bottom += weights[i]
+    if bottom <= 0:
+        return 0.
+    return top / bottom
+
+
+def find_drop_indices(percents, weights, drop_count):
+    """
+    Returns sorted list of drop_count indices, which removal gives maximal
+    weighted average of remaining items. If several subsets are optimal,
+    items with lower index are dropped first.
+    """
+    length = len(percents)
+    if len(weights) != length:
+        raise ValueError("Percents and weights must have the same length")
+    drop_count = max(0, min(drop_count, length))
+    if drop_count == 0:
+        return []
+    if drop_count == length:
+        return list(range(length))
+
+    # Start from dropping lowest percents, it is optimal for equal weights
+    dropped = _smallest(length, drop_count, lambda i: percents[i])
+    ratio = _kept_average(percents, weights, dropped)
+    for _ in range(MAX_ITERATIONS):
+        candidate = _smallest(length, drop_count, lambda i: weights[i] * (percents[i] - ratio))
+        candidate_ratio = _kept_average(percents, weights, candidate)
+        if candidate_ratio <= ratio + EPSILON * max(1., abs(ratio)):
+            if candidate_ratio >= ratio and candidate < dropped:
+                # Same ratio, but deterministic tie-breaking prefers lower indices
+                dropped = candidate
+            break
+        dropped, ratio = candidate, candidate_ratio
+    return dropped
+
+
+def drop_weighted_average(percents, weights, drop_count):
+    """
+    Drops drop_count items optimally, returns (kept indices, weighted average of kept items)
+    """
+    dropped = set(find_drop_indices(percents, weights, drop_count))
+    kept = [i for i in range(len(percents)) if i not in dropped]
+    return kept, weighted_average(percents, weights, kept)
+
+
+def _smallest(length, count, key):
+    """
+    Returns sorted indices of count smallest items by key, ties are broken by index
+    """
+    return sorted(heapq.nsmallest(count, range(length), key=lambda i: (key(i), i)))
+
+
+def _kept_average(percents, weights, dropped):
+    dropped = set(dropped)
+    return weighted_average(percents, weights, [i for i in range(len(percents)) if i not in dropped])
+
+
+def drop_greedy(percents, weights, drop_count):
+    """
+    Previous algorithm: drops drop_count items one by one with find_drop_index.
+    Kept for comparison and benchmarks, returns sorted dropped indices.
+    """
+    indices = list(range(len(percents)))
+    percents, weights = list(percents), list(weights)
+    dropped = []
+    for _ in range(min(drop_count, len(indices))):
+        index = find_drop_index(percents, weights)
+        dropped.append(indices.pop(index))
+        percents.pop(index)
+        weights.pop(index)
+    return sorted(dropped)
+
+
+def find_drop_index(percents, weights):
+    """
+    G = sum(w[i]p[i])/sum(w[i])
+    G'[j] = sum(w[i]p[i])/sum(w[i]) : i!=j
+    gain[j] = G'[j] - G
+    return: max(delta)
+    """
+    length = len(percents)
+    if len(percents) == len(weights) == 1:
+        return 0
+    top = sum([percents[i]*weights[i] for i in range(length)])
+    bot = sum(weights)
+    gain = []
+    for pair in zip(weights, percents):
+        rest = bot - pair[0]
+        if rest > 0:
+            gain.append(pair[0] * (top - bot * pair[1]) / rest)
+        else:
+            # Item carries all weight, nothing is graded without it, so G' = 0.
+            # Gains are multiplied by bot, as above
+            gain.append(-top)
+    return gain.index(max(gain))
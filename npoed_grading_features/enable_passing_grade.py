@@ -1,10 +1,11 @@
+import hashlib
+import json
 from functools import wraps
 from django.conf import settings
-from django.utils.translation import ugettext_lazy as _
 
-from .models import NpoedGradingFeatures, CoursePassingGradeUserStatus
-
-MESSAGE_TEMPLATE = _("You must earn {threshold_percent}% (got {student_percent}%) for {category}.")
+from . import grading_core
+from .local_cache import LocalCache
+from .models import NpoedGradingFeatures, CoursePassingGradeUserStatus, render_passing_grade_message
 
 
 def build_course_grading_model(class_):
@@ -50,102 +51,130 @@ def build_course_grading_model(class_):
     return UpdatedGradingModel
 
 
-def build_course_grade(class_):
+class PassingGradePolicy(object):
     """
-    Modifies CourseGrade. Changes .summary, _compute_passed and
-    _compute_letter_grade to check category passing grades.
-    Edx versions of method M are saved as _default_M.
-    Also adds marks ('x' with message) at progress graph.
+    Passing grade part of course grading policy: category thresholds and
+    sorted grade cutoffs. Compiled once per course policy version.
     """
-    def inner_passing_grades(course_grade):
-        graders = course_grade.course_data.course.grading_policy['GRADER']
-        passing_grades = dict((x['type'], x.get('passing_grade',0)) for x in graders)
-        return passing_grades
-
-    def inner_categories_get_messages(course_grade):
-        passing_grades = inner_passing_grades(course_grade)
-
-        breakdown = course_grade.grader_result['section_breakdown']
+    _compiled = LocalCache(max_size=1024, timeout=60 * 60)
+
+    def __init__(self, grading_policy):
+        graders = grading_policy['GRADER']
+        self.categories = tuple(x['type'] for x in graders)
+        self.thresholds = dict((x['type'], x.get('passing_grade', 0)) for x in graders)
+        # Categories that have passing grade, in policy order
+        self.checked_categories = tuple(x for x in self.categories if int(round(self.thresholds[x]*100)))
+        self.grade_cutoffs = dict(grading_policy['GRADE_CUTOFFS'])
+        self.descending_grades = self.sort_grades(self.grade_cutoffs)
+        self.success_cutoff = self.get_success_cutoff(self.grade_cutoffs)
+
+    sort_grades = staticmethod(grading_core.sort_grades)
+    get_success_cutoff = staticmethod(grading_core.get_success_cutoff)
+
+    @classmethod
+    def for_course(cls, course_data):
+        """
+        Returns compiled policy, cached by course version if it is known
+        or by hash of grading policy otherwise.
+        """
+        course = course_data.course
+        grading_policy = course.grading_policy
+        version = getattr(course_data, 'version', None)
+        if not version:
+            version = hashlib.sha1(json.dumps(grading_policy, sort_keys=True).encode('utf-8')).hexdigest()
+        key = (str(course.id), str(version))
+        policy = cls._compiled.get(key)
+        if policy is None:
+            policy = cls(grading_policy)
+            cls._compiled.set(key, policy)
+        return policy
+
+    def get_category_results(self, grader_result):
+        """
+        Returns list of (category, threshold, percent) for categories
+        with passing grade, ordered as in grading policy.
+        """
+        breakdown = grader_result['section_breakdown']
         results = dict((x['category'], x['percent']) for x in breakdown)
-        keys_match = len(results.keys()) == len(passing_grades.keys()) and \
-            all(x in passing_grades for x in results)
+        keys_match = len(results.keys()) == len(self.thresholds.keys()) and \
+            all(x in self.thresholds for x in results)
         if not keys_match:
             # Error handling
             return []
+        return [(category, self.thresholds[category], results[category]) for category in self.checked_categories]
 
-        status_text_pairs = []
-        for category in results.keys():
-            student_percent = int(round(results[category]*100))
-            threshold_percent = int(round(passing_grades[category]*100))
-            if threshold_percent:
-                current_status = results[category] < passing_grades[category]
-                current_text = MESSAGE_TEMPLATE.format(
-                    category=category,
-                    student_percent=student_percent,
-                    threshold_percent=threshold_percent
-                )
-                status_text_pairs.append((current_status, current_text))
-        return status_text_pairs
+
+def build_course_grade(class_):
+    """
+    Modifies CourseGrade. Changes .summary, _compute_passed and
+    _compute_letter_grade to check category passing grades.
+    Edx versions of method M are saved as _default_M.
+    Also adds marks ('x' with message) at progress graph.
+    Policy, feature state and summary are memoized at CourseGrade instance.
+    """
+    def inner_policy(course_grade):
+        policy = course_grade.__dict__.get('_passing_grade_policy')
+        if policy is None:
+            policy = PassingGradePolicy.for_course(course_grade.course_data)
+            course_grade._passing_grade_policy = policy
+        return policy
 
     def inner_switch_to_default(course_grade):
-        course_id = course_grade.course_data.course.id
-        return not NpoedGradingFeatures.is_passing_grade_enabled(course_id)
+        enabled = course_grade.__dict__.get('_passing_grade_enabled')
+        if enabled is None:
+            course_id = course_grade.course_data.course.id
+            enabled = NpoedGradingFeatures.is_passing_grade_enabled(course_id)
+            course_grade._passing_grade_enabled = enabled
+        return not enabled
 
     def _compute_passed(self, grade_cutoffs, percent):
         if inner_switch_to_default(self):
             return default__compute_passed(grade_cutoffs, percent)
-        nonzero_cutoffs = [cutoff for cutoff in grade_cutoffs.values() if cutoff > 0]
-        success_cutoff = min(nonzero_cutoffs) if nonzero_cutoffs else None
+        policy = inner_policy(self)
+        if grade_cutoffs == policy.grade_cutoffs:
+            success_cutoff = policy.success_cutoff
+        else:
+            success_cutoff = PassingGradePolicy.get_success_cutoff(grade_cutoffs)
         percent_passed = success_cutoff and percent >= success_cutoff
-        message_pairs = inner_categories_get_messages(self)
+        category_results = policy.get_category_results(self.grader_result)
         CoursePassingGradeUserStatus.set_passing_grade_status(
             user=self.user,
             course_key=self.course_data.course.id,
-            status_messages=message_pairs
+            category_results=category_results
         )
-        category_passed = not any([failed for failed, text in message_pairs])
-        return percent_passed and category_passed
+        return percent_passed and grading_core.is_category_passed(category_results)
 
     def summary(self):
+        grader_result = self.grader_result
+        memo = self.__dict__.get('_passing_grade_summary')
+        if memo is not None and memo[0] is grader_result:
+            return memo[1]
         summary = self._default_summary
-        if self.passed:
-            return summary
-        if inner_switch_to_default(self):
-            return summary
-
-        passing_grades = inner_passing_grades(self)
-
-        breakdown = self.grader_result['section_breakdown']
-        results = dict((x['category'], x['percent']) for x in breakdown)
-        for section in breakdown:
-            category = section['category']
-            is_averaged_result = section.get('prominent', False)
-            is_not_passed = results[category] < passing_grades[category]
-            if is_averaged_result and is_not_passed:
-                student_percent = int(round(results[category]*100))
-                threshold_percent = int(round(passing_grades[category]*100))
-                message = MESSAGE_TEMPLATE.format(
-                    category=category,
-                    student_percent=student_percent,
-                    threshold_percent=threshold_percent
-                )
-                section['mark'] = {'detail': message}
+        if not self.passed and not inner_switch_to_default(self):
+            thresholds = inner_policy(self).thresholds
+            breakdown = grader_result['section_breakdown']
+            results = dict((x['category'], x['percent']) for x in breakdown)
+            for section in breakdown:
+                category = section['category']
+                is_averaged_result = section.get('prominent', False)
+                is_not_passed = results[category] < thresholds[category]
+                if is_averaged_result and is_not_passed:
+                    message = render_passing_grade_message(category, thresholds[category], results[category])
+                    section['mark'] = {'detail': message}
+        self._passing_grade_summary = (grader_result, summary)
         return summary
 
     def _compute_letter_grade(self, grade_cutoffs, percent):
         if inner_switch_to_default(self):
             return default__compute_letter_grade(grade_cutoffs, percent)
-        letter_grade = None
         if not self.passed:
             percent = 0
-        # Possible grades, sorted in descending order of score
-        descending_grades = sorted(grade_cutoffs, key=lambda x: grade_cutoffs[x], reverse=True)
-        for possible_grade in descending_grades:
-            if percent >= grade_cutoffs[possible_grade]:
-                letter_grade = possible_grade
-                break
-
-        return letter_grade
+        policy = inner_policy(self)
+        if grade_cutoffs == policy.grade_cutoffs:
+            descending_grades = policy.descending_grades
+        else:
+            descending_grades = PassingGradePolicy.sort_grades(grade_cutoffs)
+        return grading_core.get_letter_grade(descending_grades, grade_cutoffs, percent)
 
     default__compute_passed = class_._compute_passed
     class_._compute_passed = _compute_passed
@@ -169,6 +198,8 @@ def build_is_course_passed(func):
     If student is given we try to get info from db.
     Otherwise consider that passing_grades are met, but actually there is no
     such calls of is_course_passed in edx currently.
+    For many students use is_course_passed.bulk(course, students), it returns
+    {student.id: passed} and reads statuses of all students at once.
     """
     @wraps(func)
     def is_course_passed(course, grade_summary=None, student=None, request=None):
@@ -185,12 +216,23 @@ def build_is_course_passed(func):
                     if section['mark'].get('detail', None):
                         has_failed = True
         elif student:
-            message_pairs = CoursePassingGradeUserStatus.get_passing_grade_status(course_key, student)
-            has_failed = any([failed for failed, text in message_pairs])
+            has_failed = CoursePassingGradeUserStatus.is_passing_grade_failed(course_key, student)
 
         is_category_grade_passed = not has_failed
         return is_category_grade_passed and func(course, grade_summary, student, request)
 
+    def is_course_passed_bulk(course, students):
+        course_key = course.id
+        students = list(students)
+        if not NpoedGradingFeatures.is_passing_grade_enabled(course_key):
+            return dict((student.id, func(course, None, student, None)) for student in students)
+        failed = CoursePassingGradeUserStatus.get_passing_grade_failed_many(course_key, students)
+        return dict(
+            (student.id, not failed[student.id] and func(course, None, student, None))
+            for student in students
+        )
+
+    is_course_passed.bulk = is_course_passed_bulk
     return is_course_passed
 
 
@@ -1,31 +1,274 @@
+import logging
+import threading
+
 from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.utils import timezone
 
-from courseware.models import StudentModule
+from courseware.models import StudentModule, StudentModuleHistory
+from .db import bulk_upsert, execute_upsert, get_unique_columns
 from .models import NpoedGradingFeatures
 from .utils import patch_function
 
+log = logging.getLogger(__name__)
+
+BULK_CHUNK_SIZE = 500
+BULK_FIELDS = ('student', 'module_state_key', 'course_id', 'module_type', 'done', 'created', 'modified', 'grade', 'max_grade')
+
+AVOIDED_REGRADES_KEY_BASE = "ProblemBestScore.avoided_regrades.{course_id}"
+
+# Outcome of score write done by score_published_handler, reused by set_score
+_prefetched = threading.local()
+
 
 def set_score(user_id, usage_key, score, max_score):
     """
     Set the score and max_score for the specified user and xblock usage
     if score is rising or grade is new
     """
-    student_module, created = StudentModule.objects.get_or_create(
+    prefetched = getattr(_prefetched, 'outcome', None)
+    if prefetched is not None and prefetched[0] == (user_id, usage_key):
+        _prefetched.outcome = None
+        return prefetched[1]
+    changed, modified = update_best_score(user_id, usage_key, score, max_score)
+    return modified
+
+
+def update_best_score(user_id, usage_key, score, max_score):
+    """
+    Writes score with one guarded UPDATE, so that concurrent attempts can't
+    overwrite higher score with lower one. Row is inserted if it's missing.
+    History of changed row is written as on StudentModule.save.
+    Returns (changed, modified): whether stored score was changed and
+    modification time of the row.
+    """
+    lookup = dict(
         student_id=user_id,
         module_state_key=usage_key,
         course_id=usage_key.course_key,
-        defaults={
-            'grade': score,
-            'max_grade': max_score,
-        }
     )
-    if not created:
-        should_update = (student_module.max_grade != max_score) or (student_module.grade < score)
-        if should_update:
-            student_module.grade = score
-            student_module.max_grade = max_score
-            student_module.save()
-    return student_module.modified
+    should_update = Q(grade__lt=score) | Q(grade__isnull=True) | ~Q(max_grade=max_score)
+    for _ in range(2):
+        now = timezone.now()
+        # update() skips auto_now, so modified is set explicitly
+        if StudentModule.objects.filter(should_update, **lookup).update(grade=score, max_grade=max_score, modified=now):
+            _save_history(StudentModule.objects.filter(**lookup))
+            return True, now
+        modified = StudentModule.objects.filter(**lookup).values_list('modified', flat=True).first()
+        if modified is not None:
+            return False, modified
+        try:
+            with transaction.atomic():
+                student_module = StudentModule.objects.create(grade=score, max_grade=max_score, **lookup)
+            return True, student_module.modified
+        except IntegrityError:
+            # Row is created by concurrent attempt, compare with it
+            pass
+    raise IntegrityError("Failed to write score for user {} and block {}".format(user_id, usage_key))
+
+
+def set_scores_bulk(usage_key, scores):
+    """
+    Sets scores of many users for one xblock, scores is a list of
+    (user_id, score, max_score). Feature flag is checked once. If problem
+    best score is enabled, stored score is changed only if it is rising or
+    max_score is changed, otherwise it's always overwritten like edx set_score does.
+    Scores are written with upsert statement per chunk, then history is
+    written for changed rows.
+    """
+    best_score = NpoedGradingFeatures.is_problem_best_score_enabled(usage_key.course_key)
+    now = timezone.now()
+    # Changed rows get modified=now, db may store it without microseconds
+    changed_since = now.replace(microsecond=0)
+    rows = [
+        (user_id, usage_key, usage_key.course_key, usage_key.block_type, 'na', now, now, score, max_score)
+        for user_id, score, max_score in scores
+    ]
+    for start in range(0, len(rows), BULK_CHUNK_SIZE):
+        chunk = rows[start:start + BULK_CHUNK_SIZE]
+        if best_score:
+            _upsert_best_scores(chunk)
+        else:
+            bulk_upsert(StudentModule, BULK_FIELDS, chunk, update_fields=('modified', 'grade', 'max_grade'))
+        _save_history(StudentModule.objects.filter(
+            student_id__in=[row[0] for row in chunk], module_state_key=usage_key,
+            course_id=usage_key.course_key, modified__gte=changed_since,
+        ), changed_since)
+
+
+def _upsert_best_scores(rows):
+    """
+    Upsert of StudentModule rows guarded with best score condition.
+    """
+    quote = connection.ops.quote_name
+    grade, max_grade, modified = quote('grade'), quote('max_grade'), quote('modified')
+    if connection.vendor == 'mysql':
+        new = "VALUES({})".format
+        condition = _best_score_condition(grade, max_grade, new(grade), new(max_grade))
+        # Mysql applies assignments in order and next ones see updated values, so grade
+        # is checked before it's changed. If condition is false max_grade is the same,
+        # thus it's assigned unconditionally.
+        on_conflict = (
+            "ON DUPLICATE KEY UPDATE {modified} = IF({condition}, {new_modified}, {modified}), "
+            "{grade} = IF({condition}, {new_grade}, {grade}), {max_grade} = {new_max_grade}"
+        ).format(
+            modified=modified, grade=grade, max_grade=max_grade, condition=condition,
+            new_modified=new(modified), new_grade=new(grade), new_max_grade=new(max_grade),
+        )
+    elif connection.vendor in ('postgresql', 'sqlite'):
+        table = quote(StudentModule._meta.db_table)
+        old = lambda column: "{}.{}".format(table, column)
+        new = "excluded.{}".format
+        on_conflict = (
+            "ON CONFLICT ({unique}) DO UPDATE SET {modified} = {new_modified}, {grade} = {new_grade}, "
+            "{max_grade} = {new_max_grade} WHERE {condition}"
+        ).format(
+            unique=", ".join(get_unique_columns(StudentModule, quote)),
+            modified=modified, grade=grade, max_grade=max_grade,
+            new_modified=new(modified), new_grade=new(grade), new_max_grade=new(max_grade),
+            condition=_best_score_condition(old(grade), old(max_grade), new(grade), new(max_grade)),
+        )
+    else:
+        raise NotImplementedError("Upsert is not supported for '{}' database".format(connection.vendor))
+    execute_upsert(StudentModule, BULK_FIELDS, rows, on_conflict)
+
+
+def _best_score_condition(grade, max_grade, new_grade, new_max_grade):
+    """
+    SQL version of update_best_score guard. GREATEST isn't used, because
+    max_grade change must overwrite grade even if it's lower.
+    """
+    return (
+        "({grade} IS NULL OR {grade} < {new_grade} OR {max_grade} <> {new_max_grade} "
+        "OR ({max_grade} IS NULL) <> ({new_max_grade} IS NULL))"
+    ).format(grade=grade, max_grade=max_grade, new_grade=new_grade, new_max_grade=new_max_grade)
+
+
+def _save_history(modules, created_since=None):
+    """
+    Raw updates and upserts skip StudentModule.save, so post_save is sent
+    for changed rows explicitly: edx receivers write StudentModuleHistory
+    or extended history rows, whichever are enabled.
+    """
+    for module in modules:
+        created = created_since is not None and module.created >= created_since
+        post_save.send(
+            sender=StudentModule, instance=module, created=created,
+            update_fields=None, raw=False, using=module._state.db,
+        )
+
+
+def _get_history_models():
+    models = [StudentModuleHistory]
+    if settings.FEATURES.get('ENABLE_CSMH_EXTENDED'):
+        from coursewarehistoryextended.models import StudentModuleHistoryExtended
+        models.append(StudentModuleHistoryExtended)
+    return models
+
+
+def iter_best_score_rescore(course_key, usage_key=None, chunk_size=1000):
+    """
+    Raises StudentModule grades of course (or of one block) to the best grade
+    from module history with the same max_grade. Modules are read with keyset
+    pagination, history is read only for modules of current chunk.
+    Yields (modules processed, modules updated, raised StudentModule rows) per chunk.
+    """
+    modules = StudentModule.objects.filter(course_id=course_key, max_grade__isnull=False)
+    if usage_key is not None:
+        modules = modules.filter(module_state_key=usage_key)
+    modules = modules.order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(modules.filter(id__gt=last_id).values_list(
+            'id', 'student_id', 'grade', 'max_grade'
+        )[:chunk_size])
+        if not chunk:
+            return
+        last_id = chunk[-1][0]
+        current = dict((module_id, (grade, max_grade)) for module_id, _, grade, max_grade in chunk)
+        best = {}
+        for history_model in _get_history_models():
+            history = history_model.objects.filter(
+                student_module_id__in=list(current), grade__isnull=False
+            ).values_list('student_module_id', 'grade', 'max_grade')
+            for module_id, grade, max_grade in history.iterator():
+                if max_grade != current[module_id][1]:
+                    continue
+                best_grade = best.get(module_id, current[module_id][0])
+                if best_grade is None or grade > best_grade:
+                    best[module_id] = grade
+
+        # Modules with equal target values are updated with one statement
+        groups = {}
+        for module_id, grade in best.items():
+            groups.setdefault((grade, current[module_id][1]), []).append(module_id)
+        updated = 0
+        now = timezone.now()
+        for (grade, max_grade), module_ids in groups.items():
+            # Guard keeps scores written concurrently by new submissions
+            updated += StudentModule.objects.filter(
+                Q(grade__lt=grade) | Q(grade__isnull=True), id__in=module_ids, max_grade=max_grade
+            ).update(grade=grade, modified=now)
+        raised = []
+        if updated:
+            raised = [
+                module for module in StudentModule.objects.filter(id__in=list(best))
+                if module.grade == best[module.id]
+            ]
+            _save_history(raised)
+        yield len(chunk), updated, raised
+
+
+def count_avoided_regrade(course_key):
+    key = AVOIDED_REGRADES_KEY_BASE.format(course_id=course_key)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Key is evicted between add and incr
+        cache.add(key, 1, None)
+
+
+def get_avoided_regrades_count(course_key):
+    """
+    Returns number of score publications that didn't change best score,
+    so score changed signal and regrade were skipped.
+    """
+    return cache.get(AVOIDED_REGRADES_KEY_BASE.format(course_id=course_key), 0)
+
+
+def build_score_published_handler(func):
+    """
+    Writes score before edx handler. If best score isn't changed, handler
+    is skipped, so neither score changed signal is sent nor subsection and
+    course grades are recalculated. Otherwise handler is called and its
+    set_score returns already written outcome.
+    Rescores with only_if_higher go to edx handler as is: it compares score
+    ratios before writing, best score check alone would accept lower ratio
+    with changed max score.
+    """
+    def score_published_handler(sender, block, user, raw_earned, raw_possible, only_if_higher, **kwargs):
+        if kwargs.get('score_deleted') or raw_earned is None or only_if_higher:
+            return func(sender, block, user, raw_earned, raw_possible, only_if_higher, **kwargs)
+        usage_key = block.location
+        changed, modified = update_best_score(user.id, usage_key, raw_earned, raw_possible)
+        if not changed:
+            count_avoided_regrade(usage_key.course_key)
+            log.debug("Best score of user %s for %s is unchanged, regrade is skipped.", user.id, usage_key)
+            return False
+        _prefetched.outcome = ((user.id, usage_key), modified)
+        try:
+            return func(sender, block, user, raw_earned, raw_possible, only_if_higher, **kwargs)
+        finally:
+            _prefetched.outcome = None
+
+    def is_enabled_for_course(args, kwargs):
+        block = kwargs['block'] if 'block' in kwargs else args[1]
+        return NpoedGradingFeatures.is_problem_best_score_enabled(block.location.course_key)
+    return patch_function(func, score_published_handler, dynamic_key=is_enabled_for_course)
 
 
 def build_set_score(func):
@@ -35,6 +278,7 @@ def build_set_score(func):
 
 replaced = {
     "set_score": build_set_score,
+    "score_published_handler": build_score_published_handler,
 }
 
 
@@ -1,11 +1,15 @@
+import hashlib
 from collections import OrderedDict
 from functools import wraps
 
 from django.conf import settings
+from django.utils import timezone
 
 from xblock.fields import Integer, Scope, Boolean
 
-from .utils import find_drop_index, vertical_grading_enabled
+from .drops import drop_weighted_average
+from .models import PersistentVerticalGrade
+from .utils import vertical_grading_enabled
 _ = lambda text: text
 
 
@@ -14,6 +18,253 @@ def uniqueify(iterable):
     return OrderedDict([(item, None) for item in iterable]).keys()
 
 
+class VerticalGrade(object):
+    """
+    Compact grade of vertical: totals, weight and format, that is all that
+    FlexibleNpoedGrader and course grade need. Its graded_total is the record
+    itself. Block attributes are read from vertical block, problem_scores
+    shown at progress page are resolved on first access with scores loaded
+    by course grade. Other attributes are taken from edx subsection grade
+    of vertical computed on first access.
+    """
+    __slots__ = (
+        'location', 'earned', 'possible', 'all_earned', 'all_possible', 'first_attempted',
+        'graded', 'weight', 'format', '_vertical', '_source', '_problem_scores', '_full',
+    )
+
+    def __init__(self, vertical, earned, possible, all_earned, all_possible, first_attempted, source):
+        """
+        source is (course_grade, course_structure) shared by all records of course grade
+        """
+        self.location = vertical.location
+        self.earned = earned
+        self.possible = possible
+        self.all_earned = all_earned
+        self.all_possible = all_possible
+        self.first_attempted = first_attempted
+        self.graded = getattr(vertical, 'graded', False)
+        self.weight = getattr(vertical, 'weight', 0)
+        self.format = getattr(vertical, 'format', '')
+        self._vertical = vertical
+        self._source = source
+        self._problem_scores = None
+        self._full = None
+
+    @property
+    def graded_total(self):
+        return self
+
+    @property
+    def all_total(self):
+        # xmodule.graders imports this package, so xmodule is imported lazily
+        from xmodule import graders
+        from xmodule.graders import AggregatedScore
+
+        if self.all_earned is None:
+            # Vertical without graded problems, its scores weren't looked up for grading
+            all_total, _ = graders.aggregate_scores(self.problem_scores.values())
+            self.all_earned, self.all_possible = all_total.earned, all_total.possible
+        return AggregatedScore(self.all_earned, self.all_possible, self.graded, self.first_attempted)
+
+    @property
+    def attempted(self):
+        return self.first_attempted is not None
+
+    @property
+    def display_name(self):
+        from xmodule import block_metadata_utils
+        return block_metadata_utils.display_name_with_default_escaped(self._vertical)
+
+    @property
+    def url_name(self):
+        from xmodule import block_metadata_utils
+        return block_metadata_utils.url_name_for_block(self._vertical)
+
+    @property
+    def due(self):
+        return getattr(self._vertical, 'due', None)
+
+    @property
+    def problem_scores(self):
+        if self._problem_scores is None:
+            course_grade, course_structure = self._source
+            self._problem_scores = _get_problem_scores(course_grade, course_structure, self._vertical, prune=False)
+        return self._problem_scores
+
+    def __getattr__(self, name):
+        # Adapter for rare callers that need full subsection grade
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._full is None:
+            self._full = compute_full_vertical_grade(self._source[0], self._vertical)
+        return getattr(self._full, name)
+
+
+class VerticalGradeStore(object):
+    """
+    Reads all vertical grades of user at course with one query, and queues
+    grades of verticals that had to be computed to be written at once.
+    Stored grade is used while course version is the same, no score inside
+    vertical was modified after it and no score was deleted. Scores are
+    both StudentModule rows and submissions API scores (ORA, staff graded).
+    """
+    def __init__(self, course_grade, course_version):
+        from courseware.models import StudentModule
+
+        self.course_grade = course_grade
+        self.user_id = course_grade.user.id
+        self.course_key = course_grade.course_data.course_key
+        self.course_version = course_version
+        # Taken before scores are read, so grade is never newer than its scores
+        self.read_at = timezone.now()
+        self.stored = PersistentVerticalGrade.read_grades(self.user_id, self.course_key)
+        self.scores_modified = dict(
+            (str(key), modified) for key, modified in StudentModule.objects.filter(
+                student_id=self.user_id, course_id=self.course_key
+            ).values_list('module_state_key', 'modified')
+        )
+        for key, modified in self._get_submissions_modified(course_grade.user):
+            self.scores_modified[key] = max(modified, self.scores_modified.get(key, modified))
+        self.unsaved = []
+
+    def _get_submissions_modified(self, user):
+        """
+        Returns (usage key, time of latest score) of submissions API scores.
+        Reset of score is a new latest score, so it's seen as modification.
+        """
+        from student.models import anonymous_id_for_user
+        from submissions.models import ScoreSummary
+
+        return ScoreSummary.objects.filter(
+            student_item__student_id=anonymous_id_for_user(user, self.course_key),
+            student_item__course_id=str(self.course_key),
+        ).values_list('student_item__item_id', 'latest__created_at')
+
+    def get(self, course_structure, vertical):
+        """
+        Returns stored grade or None if it's missing or stale
+        """
+        stored = self.stored.get(str(vertical.location))
+        if stored is None or not self.is_valid(stored, course_structure, vertical.location):
+            return None
+        grade = VerticalGrade(
+            vertical, stored.earned, stored.possible, stored.all_earned, stored.all_possible,
+            stored.first_attempted, (self.course_grade, course_structure),
+        )
+        grade.format = stored.format
+        return grade
+
+    def add(self, course_structure, subsection, vertical, grade):
+        _, scores_digest = self.scan_scores(course_structure, vertical.location)
+        self.unsaved.append({
+            'usage_key': str(vertical.location),
+            'earned': grade.graded_total.earned,
+            'possible': grade.graded_total.possible,
+            'all_earned': grade.all_total.earned,
+            'all_possible': grade.all_total.possible,
+            'first_attempted': grade.graded_total.first_attempted,
+            'weight': getattr(vertical, 'weight', 0) or 0,
+            'format': subsection.format,
+            'course_version': self.course_version,
+            'modified': self.read_at,
+            'scores_digest': scores_digest,
+        })
+
+    def scan_scores(self, course_structure, vertical_key):
+        """
+        Returns (latest modification time, digest of usage keys) of scores
+        inside vertical. Digest is empty if vertical has no scores.
+        """
+        latest, keys = None, []
+        blocks = [vertical_key]
+        while blocks:
+            block_key = blocks.pop()
+            modified = self.scores_modified.get(str(block_key))
+            if modified is not None:
+                keys.append(str(block_key))
+                latest = modified if latest is None else max(latest, modified)
+            blocks.extend(course_structure.get_children(block_key))
+        if not keys:
+            return latest, ""
+        return latest, hashlib.sha1("\n".join(sorted(keys)).encode('utf-8')).hexdigest()
+
+    def is_valid(self, stored, course_structure, vertical_key):
+        if stored.course_version != self.course_version:
+            return False
+        latest, scores_digest = self.scan_scores(course_structure, vertical_key)
+        if latest is not None and latest >= stored.modified:
+            return False
+        # Digest is changed if score was deleted, e.g. student attempts were reset
+        return scores_digest == stored.scores_digest
+
+    def save(self):
+        if self.unsaved:
+            PersistentVerticalGrade.write_grades(self.user_id, self.course_key, self.unsaved)
+            self.unsaved = []
+
+
+def _get_problem_scores(course_grade, course_structure, vertical, prune):
+    """
+    Returns OrderedDict of problem scores of vertical. If prune is set, scores of
+    vertical without graded problems are not looked up and None is returned:
+    its graded total is empty anyway. Zero weight verticals are not pruned,
+    they are still counted by grader (min_count, passing grade average).
+    """
+    # Grades app is available only at lms
+    from lms.djangoapps.grades.scores import get_score, possibly_scored
+
+    factory = course_grade._subsection_grade_factory
+    scored_blocks = [
+        course_structure[block_key] for block_key in course_structure.post_order_traversal(
+            filter_func=possibly_scored, start_node=vertical.location,
+        ) if getattr(course_structure[block_key], 'has_score', False)
+    ]
+    if prune and not any(getattr(x, 'graded', False) for x in scored_blocks):
+        return None
+    problem_scores = OrderedDict()
+    for block in scored_blocks:
+        problem_score = get_score(factory._submissions_scores, factory._csm_scores, None, block)
+        if problem_score:
+            problem_scores[block.location] = problem_score
+    return problem_scores
+
+
+def compute_full_vertical_grade(course_grade, vertical):
+    """
+    Returns edx subsection grade of vertical, it is computed only for rare
+    callers of VerticalGrade attributes that are not stored at record
+    """
+    return course_grade._get_subsection_grade(vertical)
+
+
+def compute_vertical_grades(course_grade, course_structure, verticals):
+    """
+    Returns VerticalGrade records for given verticals of one subsection.
+    Scores are resolved with loaded scores of course grade in one walk over
+    verticals subtrees, only totals are kept.
+    Zero course grade has no loaded scores, its grades are taken as is.
+    """
+    from xmodule import graders
+
+    if getattr(course_grade, '_subsection_grade_factory', None) is None:
+        return [course_grade._get_subsection_grade(vertical) for vertical in verticals]
+
+    grades = []
+    source = (course_grade, course_structure)
+    for vertical in verticals:
+        problem_scores = _get_problem_scores(course_grade, course_structure, vertical, prune=True)
+        if problem_scores is None:
+            # all_total is resolved on access, see VerticalGrade.all_total
+            grades.append(VerticalGrade(vertical, 0., 0., None, None, None, source))
+            continue
+        all_total, graded_total = graders.aggregate_scores(problem_scores.values())
+        grades.append(VerticalGrade(
+            vertical, graded_total.earned, graded_total.possible, all_total.earned, all_total.possible,
+            graded_total.first_attempted, source,
+        ))
+    return grades
+
+
 def build_course_grade(cls):
     class CourseVerticalGradeBase(cls):
         def _get_subsection_grades(self, course_structure, chapter_key):
@@ -23,19 +274,42 @@ def build_course_grade(cls):
             """
             vertical_mode = getattr(self.course_data.course, "vertical_grading", False)
             grades = []
+            store = self._get_vertical_grade_store() if vertical_mode else None
             for subsection_key in uniqueify(course_structure.get_children(chapter_key)):
                 if not vertical_mode:
                     grades.append(self._get_subsection_grade(course_structure[subsection_key]))
                 else:
                     subsection = course_structure[subsection_key]
-                    vertical_keys = course_structure.get_children(subsection_key)
-                    for vkey in vertical_keys:
-                        vertical = course_structure[vkey]
-                        grade = self._get_subsection_grade(vertical)
+                    verticals = [course_structure[vkey] for vkey in course_structure.get_children(subsection_key)]
+                    vertical_grades = [store.get(course_structure, x) if store is not None else None for x in verticals]
+                    missing = [x for x, grade in zip(verticals, vertical_grades) if grade is None]
+                    computed = iter(compute_vertical_grades(self, course_structure, missing))
+                    for index, vertical in enumerate(verticals):
+                        grade = vertical_grades[index]
+                        if grade is None:
+                            grade = next(computed)
+                            if store is not None:
+                                store.add(course_structure, subsection, vertical, grade)
                         grade.format = subsection.format
                         grade.weight = vertical.weight
                         grades.append(grade)
+            if store is not None:
+                store.save()
             return grades
+
+        def _get_vertical_grade_store(self):
+            """
+            Returns VerticalGradeStore shared by all chapters of this grade, or None
+            if grades can't be persisted: zero grades are not stored and without
+            course version stored grade can't be checked against course changes.
+            """
+            if '_vertical_grade_store' not in self.__dict__:
+                course_version = getattr(self.course_data, 'version', None)
+                if course_version and type(self).__name__ != 'ZeroCourseGrade':
+                    self._vertical_grade_store = VerticalGradeStore(self, str(course_version))
+                else:
+                    self._vertical_grade_store = None
+            return self._vertical_grade_store
     return CourseVerticalGradeBase
 
 
@@ -135,10 +409,12 @@ def build_assignment_format_grader(cls):
 
             drop_count = self.drop_count
             self.drop_count = 0
-            result = super(FlexibleNpoedGrader, self).grade(grade_sheet, generate_random_scores)
+            try:
+                result = super(FlexibleNpoedGrader, self).grade(grade_sheet, generate_random_scores)
+            finally:
+                self.drop_count = drop_count
             if not scores:
                 return result
-            self.drop_count = drop_count
 
             breakdown = result['section_breakdown']
 
@@ -160,16 +436,10 @@ def build_assignment_format_grader(cls):
 
             percent = [x['percent'] for x in breakdown if 'prominent' not in x]
             weights = [x.weight for x in scores]
-            for k in range(self.drop_count):
-                index = find_drop_index(percent, weights)
-                percent.pop(index)
-                weights.pop(index)
-                breakdown.pop(index)
-            total_weight = sum(weights)
-            if total_weight:
-                total_percent = sum([weights[i]*percent[i] for i in range(len(weights))])/total_weight
-            else:
-                total_percent = 0
+            # Items that AssignmentFormatGrader adds up to min_count have no weight
+            weights += [0] * (len(percent) - len(weights))
+            kept, total_percent = drop_weighted_average(percent, weights, self.drop_count)
+            breakdown = [breakdown[i] for i in kept] + breakdown[len(percent):]
             grading = {
                 "section_breakdown": breakdown,
                 "percent": total_percent
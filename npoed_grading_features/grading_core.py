@@ -0,0 +1,199 @@
+"""
+Grading of a course without edx: course tree, grading policy and scores are
+plain data, sequential and vertical modes, drops and passing grades give the
+same results as edx grading with this package patches. Module doesn't depend
+on django or edx, so courses can be graded offline, benchmarked and fuzzed.
+
+Only AssignmentFormatGrader categories (the ones with min_count) are supported.
+"""
+from __future__ import division
+
+from collections import namedtuple
+
+from .drops import drop_weighted_average
+
+# possible is None for blocks without score (e.g. html)
+Problem = namedtuple('Problem', ['earned', 'possible'])
+Unit = namedtuple('Unit', ['weight', 'problems'])
+# format is None for not graded subsection
+Subsection = namedtuple('Subsection', ['format', 'units'])
+Course = namedtuple('Course', ['subsections'])
+# Item of assignment category: subsection in sequential mode, unit in vertical mode
+GradedItem = namedtuple('GradedItem', ['earned', 'possible', 'weight'])
+CourseGradeResult = namedtuple('CourseGradeResult', [
+    'percent', 'letter_grade', 'passed',
+    # Category percents that give course percent
+    'category_percents',
+    # Category percents shown at progress page and checked with passing grade.
+    # In vertical mode they are simple averages of units without drops.
+    'category_averages',
+])
+
+
+class GradingPolicy(object):
+    """
+    Parts of course grading policy that are used by grading
+    """
+    def __init__(self, grading_policy):
+        self.categories = []
+        for grader in grading_policy['GRADER']:
+            self.categories.append({
+                'type': grader['type'],
+                'weight': grader.get('weight', 0),
+                'min_count': int(grader.get('min_count', 0)),
+                'drop_count': int(grader.get('drop_count', 0)),
+                'passing_grade': grader.get('passing_grade', 0),
+            })
+        self.grade_cutoffs = dict(grading_policy['GRADE_CUTOFFS'])
+        self.descending_grades = sort_grades(self.grade_cutoffs)
+        self.success_cutoff = get_success_cutoff(self.grade_cutoffs)
+
+    def checked_categories(self):
+        """
+        Categories that have passing grade
+        """
+        return [x for x in self.categories if int(round(x['passing_grade'] * 100))]
+
+
+def sort_grades(grade_cutoffs):
+    # Possible grades, sorted in descending order of score
+    return sorted(grade_cutoffs, key=lambda x: grade_cutoffs[x], reverse=True)
+
+
+def get_success_cutoff(grade_cutoffs):
+    nonzero_cutoffs = [cutoff for cutoff in grade_cutoffs.values() if cutoff > 0]
+    return min(nonzero_cutoffs) if nonzero_cutoffs else None
+
+
+def get_letter_grade(descending_grades, grade_cutoffs, percent):
+    for possible_grade in descending_grades:
+        if percent >= grade_cutoffs[possible_grade]:
+            return possible_grade
+    return None
+
+
+def is_category_passed(category_results):
+    """
+    category_results is a list of (category, threshold, percent)
+    """
+    return not any([percent < threshold for category, threshold, percent in category_results])
+
+
+def round_percent(percent):
+    # Same rounding as edx CourseGrade
+    return round(percent * 100 + 0.05) / 100
+
+
+def get_graded_items(course, vertical_mode=False):
+    """
+    Returns {format: [GradedItem]} in course order. Items without possible
+    score are skipped, as edx does; in vertical mode units with zero weight
+    are kept: they don't change weighted average, but are counted for
+    min_count and passing grade average.
+    """
+    items = {}
+    for subsection in course.subsections:
+        if subsection.format is None:
+            continue
+        if vertical_mode:
+            for unit in subsection.units:
+                earned, possible = _sum_scores([x for x in unit.problems if x.possible is not None])
+                if possible > 0:
+                    items.setdefault(subsection.format, []).append(GradedItem(earned, possible, unit.weight))
+        else:
+            problems = [x for unit in subsection.units for x in unit.problems if x.possible is not None]
+            earned, possible = _sum_scores(problems)
+            if possible > 0:
+                items.setdefault(subsection.format, []).append(GradedItem(earned, possible, 1))
+    return items
+
+
+def _sum_scores(problems):
+    return float(sum(x.earned for x in problems)), float(sum(x.possible for x in problems))
+
+
+def grade_category(category, items, vertical_mode=False):
+    """
+    Returns (category percent, category average) for list of GradedItem,
+    see CourseGradeResult.
+    """
+    percents = [x.earned / x.possible for x in items]
+    count = max(category['min_count'], len(items))
+    # AssignmentFormatGrader pads items with zeros up to min_count
+    percents += [0] * (count - len(items))
+    drop_count = category['drop_count']
+    if not vertical_mode:
+        average = _average_with_drops(percents, drop_count)
+        return average, average
+
+    average = _average_with_drops(percents, 0)
+    if not items:
+        return 0, average
+    if count == 1:
+        # Grader can't drop the only item and sets it to 0
+        percent = average if drop_count == 0 else 0
+        return percent, percent
+    weights = [x.weight for x in items] + [0] * (count - len(items))
+    return drop_weighted_average(percents, weights, drop_count)[1], average
+
+
+def _average_with_drops(percents, drop_count):
+    """
+    Simple average that drops lowest items, as AssignmentFormatGrader does
+    """
+    ordered = sorted(enumerate(percents), key=lambda x: -x[1])
+    dropped = [x[0] for x in ordered[-drop_count:]] if drop_count > 0 else []
+    total = 0
+    for index, percent in enumerate(percents):
+        if index not in dropped:
+            total += percent
+    if len(percents) - drop_count > 0:
+        total /= len(percents) - drop_count
+    return total
+
+
+def grade_items(policy, items, vertical_mode=False, passing_grade=True):
+    """
+    Grades {format: [GradedItem]}, returns CourseGradeResult
+    """
+    category_percents, category_averages = {}, {}
+    total = 0.0
+    for category in policy.categories:
+        percent, average = grade_category(category, items.get(category['type'], []), vertical_mode)
+        category_percents[category['type']] = percent
+        category_averages[category['type']] = average
+        total += percent * category['weight']
+
+    percent = round_percent(total)
+    passed = bool(policy.success_cutoff and percent >= policy.success_cutoff)
+    if passing_grade:
+        passed = passed and is_category_passed([
+            (x['type'], x['passing_grade'], category_averages[x['type']]) for x in policy.checked_categories()
+        ])
+    letter_percent = 0 if passing_grade and not passed else percent
+    letter_grade = get_letter_grade(policy.descending_grades, policy.grade_cutoffs, letter_percent)
+    return CourseGradeResult(percent, letter_grade, passed, category_percents, category_averages)
+
+
+def grade_course(course, policy, vertical_mode=False, passing_grade=True):
+    """
+    Grades Course with GradingPolicy, returns CourseGradeResult
+    """
+    return grade_items(policy, get_graded_items(course, vertical_mode), vertical_mode, passing_grade)
+
+
+def course_from_tree(tree):
+    """
+    Builds Course from tree of BuildCourseMixin format:
+    {section: {subsection: (format if graded, {unit: (weight, {problem: (earned, possible or None)})})}}
+    Order of items is the order of dicts iteration.
+    """
+    subsections = []
+    for section_tree in tree.values():
+        for assignment_category, subsection_tree in section_tree.values():
+            units = []
+            for weight, unit_tree in subsection_tree.values():
+                problems = [Problem(earned, possible) for earned, possible in unit_tree.values()]
+                units.append(Unit(weight or 0, problems))
+            subsections.append(Subsection(assignment_category or None, units))
+    return Course(subsections)
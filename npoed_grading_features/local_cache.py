@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalCache(object):
+    """
+    Process-local bounded LRU cache with time to live for entries.
+    Values are stored as is, so they should be immutable.
+    Expired entries are kept until evicted, they can be revalidated
+    by caller with get_expired/touch until they are max_age seconds old.
+    """
+    def __init__(self, max_size, timeout, max_age=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] < time.time():
+                return None
+            self._data[key] = self._data.pop(key)
+            return entry[0]
+
+    def get_expired(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[0] if entry is not None else None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            now = time.time()
+            self._data[key] = (value, now + self.timeout, now)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def touch(self, key):
+        """
+        Prolongs entry for another timeout. Returns False if entry is
+        missing or older than max_age, it should be set again then.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False
+            now = time.time()
+            if self.max_age is not None and now - entry[2] >= self.max_age:
+                return False
+            self._data.pop(key)
+            self._data[key] = (entry[0], now + self.timeout, entry[2])
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
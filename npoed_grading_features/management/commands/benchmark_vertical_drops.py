@@ -0,0 +1,57 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from npoed_grading_features.drops import drop_greedy, find_drop_indices, weighted_average
+
+
+class Command(BaseCommand):
+    """
+    This command compares optimal drop selection of FlexibleNpoedGrader with
+    previous greedy one on random verticals: time and resulting average.
+    """
+
+    help = "Benchmarks vertical drop selection. " \
+           "Example: " \
+           "'./manage.py lms benchmark_vertical_drops --sizes 1000 10000 --drop-count 10 --settings=SETTINGS'"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 10000])
+        parser.add_argument('--drop-count', type=int, nargs='+', default=[1, 10, 100])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        self.stdout.write("{:>6} {:>5} {:>12} {:>12} {:>12}".format(
+            "n", "k", "greedy, s", "optimal, s", "avg gain"
+        ))
+        for size in options['sizes']:
+            percents = [rnd.choice([0., 1., rnd.random()]) for _ in range(size)]
+            weights = [rnd.choice([0, 1, rnd.randint(1, 10)]) for _ in range(size)]
+            for drop_count in options['drop_count']:
+                greedy_time, greedy = self.measure(drop_greedy, percents, weights, drop_count, options['repeat'])
+                optimal_time, optimal = self.measure(find_drop_indices, percents, weights, drop_count, options['repeat'])
+                gain = self.kept_average(percents, weights, optimal) - self.kept_average(percents, weights, greedy)
+                self.stdout.write("{:>6} {:>5} {:>12.4f} {:>12.4f} {:>12.2e}".format(
+                    size, drop_count, greedy_time, optimal_time, gain
+                ))
+
+    @staticmethod
+    def measure(func, percents, weights, drop_count, repeat):
+        """
+        Returns best time of repeat runs and result
+        """
+        best = None
+        for _ in range(repeat):
+            started = time.time()
+            result = func(percents, weights, drop_count)
+            elapsed = time.time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    @staticmethod
+    def kept_average(percents, weights, dropped):
+        dropped = set(dropped)
+        return weighted_average(percents, weights, [i for i in range(len(percents)) if i not in dropped])
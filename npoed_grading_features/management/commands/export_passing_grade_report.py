@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.keys import CourseKey
+
+from npoed_grading_features.reports import iter_passing_grade_report, write_csv, write_jsonl
+
+_WRITERS = {
+    "csv": write_csv,
+    "jsonl": write_jsonl,
+}
+
+
+class Command(BaseCommand):
+    """
+    This command exports which learners have failed which category passing grades.
+    Statuses are streamed by chunks, so memory usage doesn't grow with course size.
+    """
+
+    help = "Exports passing grade statuses of course learners as CSV or JSON Lines. " \
+           "Example: " \
+           "'./manage.py lms export_passing_grade_report course-v1:org+course+run --output report.csv " \
+           "--settings=SETTINGS'"
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_id')
+        parser.add_argument('--format', choices=sorted(_WRITERS.keys()), default="csv")
+        parser.add_argument('--output', help="Output file, stdout by default")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            course_key = CourseKey.from_string(options['course_id'])
+        except InvalidKeyError:
+            raise CommandError("Invalid course id: '{}'".format(options['course_id']))
+        records = iter_passing_grade_report(course_key, chunk_size=options['chunk_size'])
+        writer = _WRITERS[options['format']]
+        if not options['output']:
+            writer(records, sys.stdout)
+            return
+        with open(options['output'], 'w') as stream:
+            writer(records, stream)
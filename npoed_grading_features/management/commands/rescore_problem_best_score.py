@@ -0,0 +1,99 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.keys import CourseKey, UsageKey
+from lms.djangoapps.grades.constants import ScoreDatabaseTableEnum
+from lms.djangoapps.grades.tasks import recalculate_subsection_grade_v3
+from openedx.core.djangoapps.content.block_structure.api import get_course_in_cache
+from util.date_utils import to_timestamp
+
+from npoed_grading_features.enable_problem_best_score import iter_best_score_rescore
+
+
+class Command(BaseCommand):
+    """
+    This command sets best scores from StudentModule history for course that
+    enabled problem best score after start. Modules are processed by chunks,
+    then edx grade task is enqueued once per learner and subsection with
+    raised scores, it also updates course grade of learner.
+    """
+
+    help = "Raises problem scores of course to the best ones from score history and regrades learners. " \
+           "Example: " \
+           "'./manage.py lms rescore_problem_best_score course-v1:org+course+run --settings=SETTINGS'"
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_id')
+        parser.add_argument('--problem', help="Usage id of single problem to rescore")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--skip-regrade', action='store_true', help="Don't recalculate grades of learners")
+
+    def handle(self, *args, **options):
+        try:
+            course_key = CourseKey.from_string(options['course_id'])
+            usage_key = None
+            if options['problem']:
+                usage_key = UsageKey.from_string(options['problem']).map_into_course(course_key)
+        except InvalidKeyError:
+            raise CommandError("Invalid course or problem id")
+
+        started = time.time()
+        structure = get_course_in_cache(course_key)
+        total_processed, total_updated, student_ids = 0, 0, set()
+        # (learner, subsection) -> (usage key, modified) of the latest raised score
+        regrades = {}
+        for processed, updated, modules in iter_best_score_rescore(
+            course_key, usage_key=usage_key, chunk_size=options['chunk_size']
+        ):
+            total_processed += processed
+            total_updated += updated
+            for module in modules:
+                student_ids.add(module.student_id)
+                problem_key = module.module_state_key.map_into_course(course_key)
+                key = (module.student_id, self.get_subsection(structure, problem_key))
+                if key not in regrades or module.modified > regrades[key][1]:
+                    regrades[key] = (problem_key, module.modified)
+            self.stdout.write("{} modules processed, {} scores raised".format(total_processed, total_updated))
+
+        if not options['skip_regrade']:
+            self.enqueue_regrades(course_key, regrades)
+        self.stdout.write("Done in {:.1f}s: {} scores raised for {} learners".format(
+            time.time() - started, total_updated, len(student_ids)
+        ))
+
+    @staticmethod
+    def get_subsection(structure, usage_key):
+        """
+        Returns key of subsection that contains block, or the block key itself
+        if block is not in course anymore
+        """
+        blocks = [usage_key]
+        while blocks:
+            block_key = blocks.pop()
+            if block_key.block_type == 'sequential':
+                return block_key
+            if block_key in structure:
+                blocks.extend(structure.get_parents(block_key))
+        return usage_key
+
+    def enqueue_regrades(self, course_key, regrades):
+        """
+        Enqueues the same grade task as edx score changed handler does, so learners
+        are regraded by workers. Task recalculates whole subsection of given problem
+        and course grade, it waits until it sees problem modification time.
+        """
+        for (student_id, _), (usage_key, modified) in regrades.items():
+            recalculate_subsection_grade_v3.apply_async(kwargs=dict(
+                user_id=student_id,
+                anonymous_user_id=None,
+                course_id=unicode(course_key),
+                usage_id=unicode(usage_key),
+                only_if_higher=False,
+                expected_modified_time=to_timestamp(modified),
+                score_deleted=False,
+                event_transaction_id=None,
+                event_transaction_type=None,
+                score_db_table=ScoreDatabaseTableEnum.courseware_student_module,
+            ))
+        self.stdout.write("{} regrades enqueued".format(len(regrades)))
@@ -0,0 +1,105 @@
+import re
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.keys import CourseKey
+from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
+from xmodule.modulestore.django import modulestore
+
+from npoed_grading_features.models import NpoedGradingFeatures, GradingFeatureFlags
+
+
+class Command(BaseCommand):
+    """
+    This command enables or disables grading feature for many courses at once.
+    Rows are upserted in chunks, vertical_grading is pushed to modulestore
+    synchronously for courses where it could change.
+    """
+
+    help = "Enables or disables grading feature for courses given by file, org or regex. " \
+           "Example: " \
+           "'./manage.py lms switch_grading_feature vertical_grading --org MIPT --settings=SETTINGS'"
+
+    def add_arguments(self, parser):
+        parser.add_argument('feature', choices=GradingFeatureFlags.FEATURES)
+        parser.add_argument('--disable', action='store_true', help="Disable feature instead of enabling it")
+        parser.add_argument('--file', help="File with course ids, one per line")
+        parser.add_argument('--org', help="Organization of courses")
+        parser.add_argument('--regex', help="Regular expression for course ids")
+        parser.add_argument('--chunk-size', type=int, default=NpoedGradingFeatures.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        feature = options['feature']
+        state = not options['disable']
+        course_ids = self.get_course_ids(options)
+        chunk_size = options['chunk_size']
+        if not course_ids:
+            raise CommandError("No courses found")
+
+        self.stdout.write("Switching '{}' to {} for {} courses".format(feature, state, len(course_ids)))
+        started = time.time()
+        total_changed, total_pushed, total_failed = 0, 0, 0
+        for start in range(0, len(course_ids), chunk_size):
+            chunk = course_ids[start:start + chunk_size]
+            created, updated = NpoedGradingFeatures.bulk_switch_feature(chunk, feature, state)
+            total_changed += len(created) + len(updated)
+
+            # New rows of other features have vertical_grading False, course field
+            # differs from it only if its default is changed by settings
+            if feature == "vertical_grading":
+                to_push = created + updated
+            elif getattr(settings, "VERTICAL_GRADING_DEFAULT", False):
+                to_push = created
+            else:
+                to_push = []
+            pushed = self.push_vertical_grading(to_push)
+            total_pushed += pushed
+            total_failed += len(to_push) - pushed
+
+            done = start + len(chunk)
+            elapsed = time.time() - started
+            self.stdout.write("{}/{} courses processed, {} changed, {} pushed, {:.1f} courses/s".format(
+                done, len(course_ids), total_changed, total_pushed, done / elapsed if elapsed else 0.
+            ))
+        message = "Done in {:.1f}s: {} courses changed, {} pushed to modulestore, {} pushes failed".format(
+            time.time() - started, total_changed, total_pushed, total_failed
+        )
+        self.stdout.write(message)
+
+    def get_course_ids(self, options):
+        sources = [x for x in ('file', 'org', 'regex') if options[x]]
+        if len(sources) != 1:
+            raise CommandError("Exactly one of --file, --org, --regex must be given")
+        if options['file']:
+            with open(options['file']) as f:
+                course_ids = [line.strip() for line in f if line.strip()]
+            for course_id in course_ids:
+                try:
+                    CourseKey.from_string(course_id)
+                except InvalidKeyError:
+                    raise CommandError("Invalid course id: '{}'".format(course_id))
+            return course_ids
+        if options['org']:
+            overviews = CourseOverview.objects.filter(org=options['org'])
+            return [str(course_key) for course_key in overviews.values_list('id', flat=True)]
+        pattern = re.compile(options['regex'])
+        all_ids = [str(course_key) for course_key in CourseOverview.objects.values_list('id', flat=True)]
+        return [course_id for course_id in all_ids if pattern.search(course_id)]
+
+    def push_vertical_grading(self, course_ids):
+        """
+        Pushes current db values, returns number of successful pushes
+        """
+        if not course_ids:
+            return 0
+        values = dict(NpoedGradingFeatures.objects.filter(
+            course_id__in=course_ids
+        ).values_list('course_id', 'vertical_grading'))
+        store = modulestore()
+        pushed = 0
+        for course_id in course_ids:
+            with store.bulk_operations(CourseKey.from_string(course_id)):
+                pushed += NpoedGradingFeatures._push_vertical_grading_to_modulestore(course_id, values[course_id])
+        return pushed
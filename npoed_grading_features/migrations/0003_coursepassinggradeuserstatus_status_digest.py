@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('npoed_grading_features', '0002_auto_20180514_1013'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coursepassinggradeuserstatus',
+            name='status_digest',
+            field=models.CharField(default=b'', max_length=40),
+        ),
+    ]
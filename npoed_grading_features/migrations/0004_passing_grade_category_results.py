@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+import jsonfield.fields
+
+from npoed_grading_features.db import bulk_upsert
+
+BATCH_SIZE = 1000
+MESSAGE_RE = re.compile(r"^You must earn (\d+)% \(got (\d+)%\) for (.+)\.$")
+
+
+def parse_messages(messages):
+    """
+    Returns list of (category, threshold, percent) parsed from rendered
+    messages, or None if they can't be parsed exactly (e.g. translated
+    or failure status is lost after percent rounding).
+    """
+    results = []
+    for failed, text in messages:
+        match = MESSAGE_RE.match(text)
+        if not match:
+            return None
+        threshold, percent = int(match.group(1)) / 100., int(match.group(2)) / 100.
+        if (percent < threshold) != bool(failed):
+            return None
+        results.append((match.group(3), threshold, percent))
+    return results
+
+
+def convert_status_messages(apps, schema_editor):
+    """
+    Fills category_results and is_failed from rendered messages.
+    Rows are processed in batches ordered by pk, so memory doesn't grow with table,
+    and every batch is written with one upsert.
+    Rows that can't be parsed keep messages, they are rewritten at next grade computation.
+    Legacy messages are not ordered as grading policy, so failed_mask is left unset
+    and parsed rows get empty digest: they are rewritten in policy order at next
+    grade computation too.
+    """
+    CoursePassingGradeUserStatus = apps.get_model('npoed_grading_features', 'CoursePassingGradeUserStatus')
+    fields = ('course_id', 'user', 'status_messages', 'category_results', 'is_failed', 'status_digest')
+    last_pk = 0
+    while True:
+        batch = list(CoursePassingGradeUserStatus.objects.filter(
+            pk__gt=last_pk
+        ).order_by('pk').values_list('pk', 'course_id', 'user_id', 'status_messages', 'status_digest')[:BATCH_SIZE])
+        if not batch:
+            break
+        rows = []
+        for pk, course_id, user_id, messages, digest in batch:
+            if not isinstance(messages, (list, tuple)):
+                continue
+            is_failed = any(failed for failed, text in messages)
+            results = parse_messages(messages)
+            if results is not None:
+                messages, digest = [], ""
+            rows.append((course_id, user_id, messages, results, is_failed, digest))
+        bulk_upsert(CoursePassingGradeUserStatus, fields=fields, rows=rows, update_fields=fields[2:])
+        last_pk = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('npoed_grading_features', '0003_coursepassinggradeuserstatus_status_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coursepassinggradeuserstatus',
+            name='category_results',
+            field=jsonfield.fields.JSONField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='coursepassinggradeuserstatus',
+            name='failed_mask',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='coursepassinggradeuserstatus',
+            name='is_failed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(convert_status_messages, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='coursepassinggradeuserstatus',
+            index_together=set([('course_id', 'is_failed')]),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('npoed_grading_features', '0004_passing_grade_category_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersistentVerticalGrade',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('course_id', models.CharField(max_length=255)),
+                ('usage_key', models.CharField(max_length=255)),
+                ('earned', models.FloatField()),
+                ('possible', models.FloatField()),
+                ('all_earned', models.FloatField()),
+                ('all_possible', models.FloatField()),
+                ('first_attempted', models.DateTimeField(default=None, null=True)),
+                ('weight', models.FloatField(default=0)),
+                ('format', models.CharField(default=None, max_length=255, null=True)),
+                ('course_version', models.CharField(default='', max_length=255)),
+                ('modified', models.DateTimeField()),
+                ('user', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='persistentverticalgrade',
+            unique_together=set([('user', 'course_id', 'usage_key')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('npoed_grading_features', '0005_persistentverticalgrade'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='persistentverticalgrade',
+            name='scores_digest',
+            field=models.CharField(default=b'', max_length=40),
+        ),
+    ]
@@ -1,12 +1,78 @@
+import hashlib
 import json
 import logging
+import threading
+from contextlib import contextmanager
+from uuid import uuid4
+
 from django.contrib.auth.models import User
 from django.core.cache import cache
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils.translation import ugettext_lazy as _
 from jsonfield.fields import JSONField
 from opaque_keys.edx.keys import CourseKey
+from openedx.core.djangoapps.request_cache import get_cache as get_request_cache
 from xmodule.modulestore.django import modulestore
 
+from . import modulestore_sync
+from .db import bulk_upsert
+from .local_cache import LocalCache
+
+class GradingFeatureFlags(object):
+    """
+    Immutable set of grading features enabled for course, stored as bitmask.
+    Used instead of NpoedGradingFeatures instances at flag lookups.
+    """
+    FEATURES = ("vertical_grading", "passing_grade", "problem_best_score")
+    __slots__ = ("mask",)
+
+    def __init__(self, mask=0):
+        object.__setattr__(self, "mask", int(mask))
+
+    @classmethod
+    def from_values(cls, **values):
+        mask = 0
+        for bit, feature in enumerate(cls.FEATURES):
+            if values.get(feature):
+                mask |= 1 << bit
+        return cls(mask)
+
+    def as_dict(self):
+        return dict((feature, getattr(self, feature)) for feature in self.FEATURES)
+
+    @property
+    def vertical_grading(self):
+        return bool(self.mask & 1)
+
+    @property
+    def passing_grade(self):
+        return bool(self.mask & 2)
+
+    @property
+    def problem_best_score(self):
+        return bool(self.mask & 4)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GradingFeatureFlags is immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, GradingFeatureFlags) and self.mask == other.mask
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.mask)
+
+    def __repr__(self):
+        return "GradingFeatureFlags({})".format(self.mask)
+
+
+# Flags of the course that has no NpoedGradingFeatures row
+DEFAULT_FLAGS = GradingFeatureFlags()
+
 
 class NpoedGradingFeatures(models.Model):
     """
@@ -17,8 +83,33 @@ class NpoedGradingFeatures(models.Model):
     passing_grade = models.BooleanField(default=False)
     problem_best_score = models.BooleanField(default=False)
 
-    KEY_BASE = "NpoedGradingFeatures.{course_id}"
+    KEY_BASE = "NpoedGradingFeatures.v2.{course_id}"
+    # Json-ized rows written by previous package versions. They are read if
+    # there is no entry under KEY_BASE and dropped on every change; previous
+    # versions can't decode new values, so they are never written there
+    LEGACY_KEY_BASE = "NpoedGradingFeatures.{course_id}"
     TIMEOUT = 300
+    # Cached instead of a row for courses that have no NpoedGradingFeatures,
+    # so that unconfigured courses don't hit db on every flag check
+    ABSENT_MARKER = "absent"
+    # Cached value is (CACHE_FORMAT_VERSION, flags mask)
+    CACHE_FORMAT_VERSION = 1
+
+    # Flags are also kept in process memory for LOCAL_TIMEOUT seconds. After that
+    # generation from the shared cache is checked, it is changed on every save/delete.
+    # Generation key can be evicted, so flags are re-read anyway after LOCAL_MAX_AGE
+    GENERATION_KEY_BASE = "NpoedGradingFeatures.generation.{course_id}"
+    LOCAL_TIMEOUT = 5
+    LOCAL_MAX_AGE = 60
+    LOCAL_MAX_SIZE = 2048
+    # Max number of course ids in one 'IN' query
+    CHUNK_SIZE = 500
+    _local_cache = LocalCache(max_size=LOCAL_MAX_SIZE, timeout=LOCAL_TIMEOUT, max_age=LOCAL_MAX_AGE)
+
+    def __init__(self, *args, **kwargs):
+        super(NpoedGradingFeatures, self).__init__(*args, **kwargs)
+        # Flags as they are stored at db, None for not saved rows
+        self._stored_flags = self.flags if self.pk else None
 
     @classmethod
     def is_vertical_grading_enabled(cls, course_id):
@@ -34,37 +125,45 @@ class NpoedGradingFeatures(models.Model):
 
     @classmethod
     def enable_vertical_grading(cls, course_id):
-        cls._switch_feature(course_id, "vertical_grading", True)
+        return cls._switch_feature(course_id, "vertical_grading", True)
 
     @classmethod
     def enable_passing_grade(cls, course_id):
-        cls._switch_feature(course_id, "passing_grade", True)
+        return cls._switch_feature(course_id, "passing_grade", True)
 
     @classmethod
     def enable_problem_best_score_grade(cls, course_id):
-        cls._switch_feature(course_id, "problem_best_score", True)
+        return cls._switch_feature(course_id, "problem_best_score", True)
 
     @classmethod
     def disable_vertical_grading(cls, course_id):
-        cls._switch_feature(course_id, "vertical_grading", False)
+        return cls._switch_feature(course_id, "vertical_grading", False)
 
     @classmethod
     def disable_passing_grade(cls, course_id):
-        cls._switch_feature(course_id, "passing_grade", False)
+        return cls._switch_feature(course_id, "passing_grade", False)
 
     @classmethod
     def disable_problem_best_score_grade(cls, course_id):
-        cls._switch_feature(course_id, "problem_best_score", False)
+        return cls._switch_feature(course_id, "problem_best_score", False)
 
     @classmethod
     def _push_vertical_grading_to_modulestore(cls, course_key, value):
+        """
+        Returns True if course has given value after push. Course is not
+        updated if it already has the value, e.g. for new rows created
+        when only other features are switched.
+        """
         course_key = CourseKey.from_string(cls._get_id(course_key))
         value = bool(value)
         store = modulestore()
         try:
             course = store.get_course(course_key)
+            if course.vertical_grading == value:
+                return True
             course.vertical_grading = value
             store.update_item(course, 0)
+            return True
         except Exception as e:
             message = "Failed to push vertical grading value '{}' for course '{}'.".format(
                 str(value),
@@ -73,21 +172,60 @@ class NpoedGradingFeatures(models.Model):
             message += "Are NpoedGradingFeatures enabled?"
             message += "Exception:{}".format(str(e))
             logging.error(message)
+            return False
 
     @classmethod
     def get(cls, course_id, allow_cached=False):
         cid = cls._get_id(course_id)
         if allow_cached:
             value = cls._get_cache(cid)
+            if value is cls.ABSENT_MARKER:
+                return None
             if value:
-                return value
+                return cls(course_id=cid, **value.as_dict())
         try:
             value = cls.objects.get(course_id=cid)
             value._set_cache()
             return value
         except cls.DoesNotExist:
+            cls._set_absent_cache(cid)
             return None
 
+    @classmethod
+    def get_many(cls, course_ids):
+        """
+        Returns dict {course_id: GradingFeatureFlags} for all given courses
+        with one cache request and db query for cache misses.
+        Courses without row get DEFAULT_FLAGS.
+        """
+        ids = dict((course_id, cls._get_id(course_id)) for course_id in course_ids)
+        keys = dict((cls.KEY_BASE.format(course_id=cid), cid) for cid in set(ids.values()))
+        legacy_keys = dict((cls.LEGACY_KEY_BASE.format(course_id=cid), cid) for cid in keys.values())
+        cached = cache.get_many(list(keys.keys()) + list(legacy_keys.keys()))
+        flags_by_cid = {}
+        for key, cid in list(keys.items()) + list(legacy_keys.items()):
+            if cid in flags_by_cid:
+                continue
+            value = cls._decode_cache(cached.get(key))
+            if value is cls.ABSENT_MARKER:
+                flags_by_cid[cid] = DEFAULT_FLAGS
+            elif value:
+                flags_by_cid[cid] = value
+
+        missing = [cid for cid in keys.values() if cid not in flags_by_cid]
+        to_cache = {}
+        for start in range(0, len(missing), cls.CHUNK_SIZE):
+            for row in cls.objects.filter(course_id__in=missing[start:start + cls.CHUNK_SIZE]):
+                flags_by_cid[row.course_id] = row.flags
+                to_cache[cls.KEY_BASE.format(course_id=row.course_id)] = row._to_cache_value()
+        for cid in missing:
+            if cid not in flags_by_cid:
+                flags_by_cid[cid] = DEFAULT_FLAGS
+                to_cache[cls.KEY_BASE.format(course_id=cid)] = cls.ABSENT_MARKER
+        if to_cache:
+            cache.set_many(to_cache, cls.TIMEOUT)
+        return dict((course_id, flags_by_cid[cid]) for course_id, cid in ids.items())
+
     @classmethod
     def _get_id(cls, course_id):
         if isinstance(course_id, CourseKey):
@@ -96,58 +234,220 @@ class NpoedGradingFeatures(models.Model):
 
     @classmethod
     def _is_feature_enabled(cls, course_id, feature):
-        cid = cls._get_id(course_id)
-        grading_features = cls.get(course_id=cid, allow_cached=True)
-        if grading_features:
-            return getattr(grading_features, feature)
+        flags = cls._get_flags(course_id)
+        if flags:
+            return getattr(flags, feature)
         else:
             return False
 
+    @classmethod
+    def _get_flags(cls, course_id):
+        """
+        Returns GradingFeatureFlags for course or None if course has no row.
+        Looks up process-local cache first, then shared cache and db.
+        """
+        cid = cls._get_id(course_id)
+        entry = cls._local_cache.get(cid)
+        if entry is not None:
+            return entry[1]
+        generation = cache.get(cls.GENERATION_KEY_BASE.format(course_id=cid))
+        entry = cls._local_cache.get_expired(cid)
+        if entry is not None and entry[0] == generation and cls._local_cache.touch(cid):
+            return entry[1]
+        flags = cls._get_cache(cid)
+        if flags is None:
+            grading_features = cls.get(course_id=cid)
+            flags = grading_features.flags if grading_features else None
+        elif flags is cls.ABSENT_MARKER:
+            flags = None
+        cls._local_cache.set(cid, (generation, flags))
+        return flags
+
+    @classmethod
+    def _bump_generation(cls, course_id):
+        cid = cls._get_id(course_id)
+        cache.set(cls.GENERATION_KEY_BASE.format(course_id=cid), uuid4().hex, None)
+        cache.delete(cls.LEGACY_KEY_BASE.format(course_id=cid))
+        cls._local_cache.delete(cid)
+
+    @property
+    def flags(self):
+        return GradingFeatureFlags.from_values(
+            vertical_grading=self.vertical_grading,
+            passing_grade=self.passing_grade,
+            problem_best_score=self.problem_best_score
+        )
+
     @classmethod
     def _switch_feature(cls, course_id, feature, state):
+        """
+        Updates only given feature column with single query, so that concurrent
+        switches of different features don't overwrite each other. Row is
+        inserted if it is missing. Returns True if modulestore push was queued.
+        """
         cid = cls._get_id(course_id)
-        grading_features, created = cls.objects.get_or_create(course_id=cid)
-        setattr(grading_features, feature, state)
-        grading_features.save()
+        for attempt in range(2):
+            if cls.objects.filter(course_id=cid).exclude(**{feature: state}).update(**{feature: state}):
+                break
+            if attempt:
+                # Row exists and already has given state
+                return False
+            try:
+                with transaction.atomic():
+                    grading_features = cls(course_id=cid, **{feature: state})
+                    return grading_features.save(force_insert=True)
+            except IntegrityError:
+                # Row is created concurrently (maybe with other flag), update is repeated
+                pass
+        # Other flags are not known here, so cached row is dropped instead of rewriting it
+        cache.delete(cls.KEY_BASE.format(course_id=cid))
+        cls._bump_generation(cid)
+        if feature == "vertical_grading":
+            return modulestore_sync.schedule(cid, state)
+        return False
 
-    def _to_json(self):
-        return json.dumps({
-            "course_id": self.course_id,
-            "passing_grade": self.passing_grade,
-            "vertical_grading": self.vertical_grading,
-            "problem_best_score": self.problem_best_score
-        })
+    @classmethod
+    def bulk_switch_feature(cls, course_ids, feature, state):
+        """
+        Sets feature state for many courses with one query per operation:
+        missing rows are bulk created, changed ones are updated with
+        single UPDATE. Cache is refreshed with set_many. Modulestore is
+        not touched, returns (created, updated) course ids so that caller
+        could push vertical_grading for them.
+        """
+        if feature not in GradingFeatureFlags.FEATURES:
+            raise ValueError("Unknown grading feature: '{}'".format(feature))
+        cids = list(set(cls._get_id(course_id) for course_id in course_ids))
+        stored = {}
+        for row in cls.objects.filter(course_id__in=cids).values('course_id', *GradingFeatureFlags.FEATURES):
+            stored[row.pop('course_id')] = row
+        created = [cid for cid in cids if cid not in stored]
+        updated = [cid for cid, values in stored.items() if values[feature] != state]
+
+        if created:
+            cls.objects.bulk_create([cls(course_id=cid, **{feature: state}) for cid in created])
+        if updated:
+            cls.objects.filter(course_id__in=updated).update(**{feature: state})
+
+        values_by_cid = dict((cid, {feature: state}) for cid in created)
+        for cid in updated:
+            values_by_cid[cid] = dict(stored[cid], **{feature: state})
+        if values_by_cid:
+            cache.set_many(dict(
+                (cls.KEY_BASE.format(course_id=cid), (cls.CACHE_FORMAT_VERSION, GradingFeatureFlags.from_values(**values).mask))
+                for cid, values in values_by_cid.items()
+            ), cls.TIMEOUT)
+            cache.set_many(dict(
+                (cls.GENERATION_KEY_BASE.format(course_id=cid), uuid4().hex) for cid in values_by_cid
+            ), None)
+            cache.delete_many([cls.LEGACY_KEY_BASE.format(course_id=cid) for cid in values_by_cid])
+            for cid in values_by_cid:
+                cls._local_cache.delete(cid)
+        return created, updated
+
+    def get_dirty_fields(self):
+        """
+        Returns names of features changed since row was loaded or saved.
+        All features are dirty for not saved row.
+        """
+        if self._stored_flags is None:
+            return list(GradingFeatureFlags.FEATURES)
+        flags = self.flags
+        return [x for x in GradingFeatureFlags.FEATURES if getattr(flags, x) != getattr(self._stored_flags, x)]
+
+    def _to_cache_value(self):
+        return self.CACHE_FORMAT_VERSION, self.flags.mask
 
     @classmethod
-    def _from_json(cls, data):
-        return cls(**json.loads(data))
+    def _decode_cache(cls, data):
+        """
+        Returns GradingFeatureFlags, ABSENT_MARKER or None for unknown data.
+        """
+        if not data:
+            return None
+        if data == cls.ABSENT_MARKER:
+            return cls.ABSENT_MARKER
+        if isinstance(data, (tuple, list)):
+            if len(data) == 2 and data[0] == cls.CACHE_FORMAT_VERSION:
+                return GradingFeatureFlags(data[1])
+            return None
+        # Json-ized row from LEGACY_KEY_BASE
+        try:
+            return GradingFeatureFlags.from_values(**json.loads(data))
+        except (TypeError, ValueError):
+            return None
 
     def _set_cache(self):
         key = self.KEY_BASE.format(course_id=str(self.course_id))
-        cache.set(key, self._to_json(), self.TIMEOUT)
+        cache.set(key, self._to_cache_value(), self.TIMEOUT)
+
+    @classmethod
+    def _set_absent_cache(cls, course_id):
+        key = cls.KEY_BASE.format(course_id=str(course_id))
+        cache.set(key, cls.ABSENT_MARKER, cls.TIMEOUT)
 
     @classmethod
     def _get_cache(cls, course_id):
+        """
+        Returns cached GradingFeatureFlags, ABSENT_MARKER if it is known that
+        course has no row, or None if nothing is cached.
+        """
         key = cls.KEY_BASE.format(course_id=str(course_id))
-        data = cache.get(key)
-        if data:
-            return cls._from_json(data)
+        legacy_key = cls.LEGACY_KEY_BASE.format(course_id=str(course_id))
+        cached = cache.get_many([key, legacy_key])
+        value = cls._decode_cache(cached.get(key))
+        if value is None:
+            value = cls._decode_cache(cached.get(legacy_key))
+        return value
 
     def save(self, *args, **kwargs):
+        """
+        Course in modulestore is updated only if vertical_grading is changed,
+        because it is heavy write. Update is done by modulestore_sync outside
+        of current request. Returns True if update was queued.
+        """
+        dirty_fields = self.get_dirty_fields()
         super(NpoedGradingFeatures, self).save(*args, **kwargs)
-        self._push_vertical_grading_to_modulestore(self.course_id, self.vertical_grading)
+        pushed = False
+        if "vertical_grading" in dirty_fields:
+            pushed = modulestore_sync.schedule(self.course_id, self.vertical_grading)
+        self._stored_flags = self.flags
         self._set_cache()
+        if dirty_fields:
+            self._bump_generation(self.course_id)
+        return pushed
 
     def __str__(self):
         return "NGF<{}>({}/{}/{})".format(self.course_id, int(self.passing_grade), int(self.problem_best_score), int(self.vertical_grading))
 
 
+@receiver(post_delete, sender=NpoedGradingFeatures)
+def invalidate_deleted_grading_features(sender, instance, **kwargs):
+    """
+    Handles both instance.delete() and queryset deletes (e.g. from admin).
+    """
+    sender._set_absent_cache(instance.course_id)
+    sender._bump_generation(instance.course_id)
+
+
+MESSAGE_TEMPLATE = _("You must earn {threshold_percent}% (got {student_percent}%) for {category}.")
+
+
+def render_passing_grade_message(category, threshold, percent):
+    return MESSAGE_TEMPLATE.format(
+        category=category,
+        student_percent=int(round(percent * 100)),
+        threshold_percent=int(round(threshold * 100))
+    )
+
+
 class CoursePassingGradeUserStatus(models.Model):
     """
-    Stores course passing grade results for student. Results are
-    stored as a json-ized list of messages where is specified which
-    passing grades are failed by user. These messages are shown at
-    progress page as unmet requirements.
+    Stores course passing grade results for student. Results are stored
+    as a list of (category, threshold, percent) for categories with passing
+    grade. Messages about failed categories are rendered from them when
+    they are shown at progress page as unmet requirements.
+    Rows written by older versions may only have rendered status_messages.
     """
     course_id = models.CharField(max_length=255)
     user = models.ForeignKey(User)
@@ -155,31 +455,322 @@ class CoursePassingGradeUserStatus(models.Model):
         default={},
         verbose_name="Message that specifies what user has to do to pass"
     )
+    status_digest = models.CharField(max_length=40, default="")
+    category_results = JSONField(null=True, default=None)
+    is_failed = models.BooleanField(default=False)
+    # Bit i is set if user failed i-th category of category_results,
+    # categories are ordered as in grading policy. Rows converted from legacy
+    # messages (migration 0004) have it unset until grade is recomputed
+    failed_mask = models.IntegerField(default=0)
+
+    # (digest, category_results, legacy status_messages) is cached per user:
+    # statuses are read at every progress page and recomputing the same grade
+    # shouldn't write to db. Within request statuses are also kept at request
+    # cache. Missing row is cached as ("", None, None)
+    KEY_BASE = "CoursePassingGradeUserStatus.v2.{course_id}.{user_id}"
+    REQUEST_CACHE_NAME = "npoed_grading_features.passing_grade_status"
+    TIMEOUT = 60 * 60
+    # Number of statuses buffered and written at once inside batch()
+    CHUNK_SIZE = 500
+    _batches = threading.local()
 
     class Meta:
         unique_together = ("course_id", "user")
+        # Failed statuses are looked up per course
+        index_together = (("course_id", "is_failed"),)
 
     @classmethod
     def get_passing_grade_status(cls, course_key, user):
+        """
+        Returns list of (failed, message) for categories with passing grade
+        """
+        digest, results, legacy_messages = cls._get_status(course_key, user)
+        if results is not None:
+            return [
+                (percent < threshold, render_passing_grade_message(category, threshold, percent))
+                for category, threshold, percent in results
+            ]
+        if legacy_messages is not None:
+            return legacy_messages
+        return tuple("You progress is not processed yet")
+
+    @classmethod
+    def is_passing_grade_failed(cls, course_key, user):
+        """
+        Returns True if user has failed any category passing grade.
+        Doesn't render messages.
+        """
+        return cls._is_status_failed(*cls._get_status(course_key, user))
+
+    @classmethod
+    def get_passing_grade_failed_many(cls, course_key, users):
+        """
+        Returns {user_id: failed} with one query per CHUNK_SIZE users.
+        Users without status are considered as not failed.
+        """
         course_id = str(course_key)
         if not NpoedGradingFeatures.is_passing_grade_enabled(course_id):
             raise ValueError("Passing grade is not enabled for course {}.".format(
                 course_id
             ))
-        try:
-            row = cls.objects.get(course_id=course_id, user=user)
-            messages = row.status_messages
-        except cls.DoesNotExist:
-            messages = tuple("You progress is not processed yet")
-        return messages
+        buffered = cls._get_batch(course_id) or {}
+        failed = {}
+        to_load = []
+        for user in users:
+            user_id = getattr(user, 'id', user)
+            if user_id in buffered:
+                failed[user_id] = cls._is_status_failed(None, buffered[user_id], None)
+            else:
+                to_load.append(user_id)
+        for start in range(0, len(to_load), cls.CHUNK_SIZE):
+            failed.update(cls.objects.filter(
+                course_id=course_id, user_id__in=to_load[start:start + cls.CHUNK_SIZE]
+            ).values_list('user_id', 'is_failed'))
+        for user_id in to_load:
+            failed.setdefault(user_id, False)
+        return failed
+
+    @classmethod
+    def _get_status(cls, course_key, user):
+        """
+        Returns (digest, category_results, legacy_messages) from batch, request cache,
+        cache or db.
+        """
+        course_id = str(course_key)
+        if not NpoedGradingFeatures.is_passing_grade_enabled(course_id):
+            raise ValueError("Passing grade is not enabled for course {}.".format(
+                course_id
+            ))
+        buffered = cls._get_batch(course_id)
+        user_id = getattr(user, 'id', user)
+        if buffered and user_id in buffered:
+            return cls.get_digest(buffered[user_id]), buffered[user_id], None
+        value = cls._get_cached_status(course_id, user_id)
+        if value is None:
+            try:
+                value = cls.objects.get(course_id=course_id, user_id=user_id)._status_value()
+            except cls.DoesNotExist:
+                value = ("", None, None)
+            cls._set_cached_statuses(course_id, {user_id: value})
+        return value
+
+    def _status_value(self):
+        legacy_messages = self.status_messages if self.category_results is None else None
+        return self.status_digest, self.category_results, legacy_messages
+
+    @staticmethod
+    def _is_status_failed(digest, results, legacy_messages):
+        if results is not None:
+            return any(percent < threshold for category, threshold, percent in results)
+        if legacy_messages:
+            return any(failed for failed, text in legacy_messages)
+        return False
+
+    @staticmethod
+    def _get_failed_mask(results):
+        mask = 0
+        for bit, (category, threshold, percent) in enumerate(results):
+            if percent < threshold:
+                mask |= 1 << bit
+        return mask
 
     @classmethod
-    def set_passing_grade_status(cls, course_key, user, status_messages):
+    def _get_cached_status(cls, course_id, user_id):
+        """
+        Returns status value from request cache or cache, None if not cached.
+        """
+        key = cls.KEY_BASE.format(course_id=course_id, user_id=user_id)
+        request_cache = get_request_cache(cls.REQUEST_CACHE_NAME)
+        value = request_cache.get(key)
+        if value is None:
+            value = cache.get(key)
+            if value is not None:
+                request_cache[key] = value
+        return value
+
+    @classmethod
+    def _set_cached_statuses(cls, course_id, values_by_user, fill_request_cache=True):
+        """
+        Writes values to cache and request cache. Without fill_request_cache
+        values already read in this request are dropped from request cache
+        instead, so long batch jobs don't keep every status in memory.
+        """
+        values = dict(
+            (cls.KEY_BASE.format(course_id=course_id, user_id=user_id), value)
+            for user_id, value in values_by_user.items()
+        )
+        cache.set_many(values, cls.TIMEOUT)
+        request_cache = get_request_cache(cls.REQUEST_CACHE_NAME)
+        if fill_request_cache:
+            request_cache.update(values)
+        else:
+            for key in values:
+                request_cache.pop(key, None)
+
+    @classmethod
+    def set_passing_grade_status(cls, course_key, user, category_results, row=None):
+        """
+        Writes list of (category, threshold, percent) only if it differs from
+        stored one. Row can be passed if caller already has it. Returns True
+        if row was written.
+        """
         course_id = str(course_key)
         if not NpoedGradingFeatures.is_passing_grade_enabled(course_id):
             raise ValueError("Passing grade is not enabled for course {}.".format(
                 course_id
             ))
-        row, created = cls.objects.get_or_create(course_id=course_id, user=user)
-        row.status_messages = status_messages
+        buffered = cls._get_batch(course_id)
+        if buffered is not None:
+            buffered[getattr(user, 'id', user)] = category_results
+            if len(buffered) >= cls.CHUNK_SIZE:
+                cls._flush_batch(course_id, buffered)
+            return True
+        digest = cls.get_digest(category_results)
+        user_id = getattr(user, 'id', user)
+        if row is None:
+            cached = cls._get_cached_status(course_id, user_id)
+            if cached is not None and cached[0] == digest:
+                return False
+            try:
+                row = cls.objects.get(course_id=course_id, user=user)
+            except cls.DoesNotExist:
+                row = cls(course_id=course_id, user=user)
+        if row.pk and row.status_digest == digest:
+            cls._set_cached_statuses(course_id, {user_id: row._status_value()})
+            return False
+        row.category_results = category_results
+        row.is_failed = cls._is_status_failed(digest, category_results, None)
+        row.failed_mask = cls._get_failed_mask(category_results)
+        row.status_messages = []
+        row.status_digest = digest
         row.save()
+        cls._set_cached_statuses(course_id, {user_id: (digest, category_results, None)})
+        return True
+
+    @classmethod
+    @contextmanager
+    def batch(cls, course_key):
+        """
+        Inside this context statuses for the course are collected in memory
+        and written by chunks with bulk upsert; unchanged ones are skipped.
+        Buffered statuses are seen by get_passing_grade_status. If the block
+        raises, statuses collected before the error are still written. Usage:
+
+            with CoursePassingGradeUserStatus.batch(course_key):
+                for user in users:
+                    CourseGradeFactory().update(user, course)
+        """
+        course_id = str(course_key)
+        batches = cls._get_batches()
+        if course_id in batches:
+            # Nested batch, outer one flushes
+            yield
+            return
+        buffered = batches[course_id] = {}
+        completed = False
+        try:
+            yield
+            completed = True
+        finally:
+            batches.pop(course_id, None)
+            if completed:
+                cls._flush_batch(course_id, buffered)
+            elif buffered:
+                # Flush error must not hide the original one
+                try:
+                    cls._flush_batch(course_id, buffered)
+                except Exception:
+                    logging.exception(
+                        "Lost %s buffered passing grade statuses of course '%s'.", len(buffered), course_id
+                    )
+
+    @classmethod
+    def _get_batches(cls):
+        if not hasattr(cls._batches, 'by_course'):
+            cls._batches.by_course = {}
+        return cls._batches.by_course
+
+    @classmethod
+    def _get_batch(cls, course_id):
+        return cls._get_batches().get(course_id)
+
+    @classmethod
+    def _flush_batch(cls, course_id, buffered):
+        user_ids = list(buffered.keys())
+        for start in range(0, len(user_ids), cls.CHUNK_SIZE):
+            chunk = user_ids[start:start + cls.CHUNK_SIZE]
+            stored_digests = dict(cls.objects.filter(
+                course_id=course_id, user_id__in=chunk
+            ).values_list('user_id', 'status_digest'))
+            rows, to_cache = [], {}
+            for user_id in chunk:
+                results = buffered[user_id]
+                digest = cls.get_digest(results)
+                if stored_digests.get(user_id) != digest:
+                    is_failed = cls._is_status_failed(digest, results, None)
+                    rows.append((course_id, user_id, results, is_failed, cls._get_failed_mask(results), [], digest))
+                to_cache[user_id] = (digest, results, None)
+            fields = ('course_id', 'user', 'category_results', 'is_failed', 'failed_mask', 'status_messages', 'status_digest')
+            bulk_upsert(cls, fields=fields, rows=rows, update_fields=fields[2:])
+            cls._set_cached_statuses(course_id, to_cache, fill_request_cache=False)
+        buffered.clear()
+
+    @staticmethod
+    def get_digest(category_results):
+        # Tuples become lists after json field round trip, so they are compared as json
+        data = json.dumps(category_results, sort_keys=True)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class PersistentVerticalGrade(models.Model):
+    """
+    Stores grade of vertical for courses with vertical grading. Edx persists
+    only subsection grades, so without it every vertical grade is computed
+    from raw scores at each course grade computation.
+    Grade is valid while course version is the same, no score inside vertical
+    was modified after grade and no score was deleted: scores_digest is
+    the digest of usage keys of vertical scores (see enable_vertical_grading).
+    """
+    user = models.ForeignKey(User)
+    course_id = models.CharField(max_length=255)
+    usage_key = models.CharField(max_length=255)
+    earned = models.FloatField()
+    possible = models.FloatField()
+    all_earned = models.FloatField()
+    all_possible = models.FloatField()
+    first_attempted = models.DateTimeField(null=True, default=None)
+    weight = models.FloatField(default=0)
+    format = models.CharField(max_length=255, null=True, default=None)
+    course_version = models.CharField(max_length=255, default="")
+    modified = models.DateTimeField()
+    scores_digest = models.CharField(max_length=40, default="")
+
+    FIELDS = (
+        'user', 'course_id', 'usage_key', 'earned', 'possible', 'all_earned', 'all_possible',
+        'first_attempted', 'weight', 'format', 'course_version', 'modified', 'scores_digest'
+    )
+    CHUNK_SIZE = 500
+
+    class Meta:
+        unique_together = ("user", "course_id", "usage_key")
+
+    @classmethod
+    def read_grades(cls, user_id, course_key):
+        """
+        Returns {usage_key: grade} for all verticals of user at course, with one query
+        """
+        grades = cls.objects.filter(user_id=user_id, course_id=str(course_key))
+        return dict((grade.usage_key, grade) for grade in grades)
+
+    @classmethod
+    def write_grades(cls, user_id, course_key, grades):
+        """
+        Upserts grades given as list of dicts with model fields
+        except user and course_id.
+        """
+        rows = [
+            tuple([user_id, str(course_key)] + [grade[name] for name in cls.FIELDS[2:]])
+            for grade in grades
+        ]
+        for start in range(0, len(rows), cls.CHUNK_SIZE):
+            bulk_upsert(cls, fields=cls.FIELDS, rows=rows[start:start + cls.CHUNK_SIZE], update_fields=cls.FIELDS[3:])
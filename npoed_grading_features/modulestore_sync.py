@@ -0,0 +1,134 @@
+"""
+Deferred push of NpoedGradingFeatures.vertical_grading to course field at
+modulestore. Course update is heavy, so it is done outside of request thread,
+retried on failure and coalesced: requested value is kept at cache next to
+pending marker and read when push is executed, thus one queued push is enough
+for any number of flag changes. Push doesn't read db, so it doesn't depend on
+commit of the request transaction (Django 1.8 has no commit hooks).
+
+Executor is set by NPOED_GRADING_FEATURES_SYNC_EXECUTOR setting:
+"thread" (default), "inline" or dotted path to the celery-like task with
+apply_async(args, countdown) that calls run(*args).
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+log = logging.getLogger(__name__)
+
+PENDING_KEY_BASE = "NpoedGradingFeatures.sync.pending.{course_id}"
+VALUE_KEY_BASE = "NpoedGradingFeatures.sync.value.{course_id}"
+STATUS_KEY_BASE = "NpoedGradingFeatures.sync.status.{course_id}"
+# Pending flag expires if executor lost the push, so that next change could queue a new one
+PENDING_TIMEOUT = 600
+STATUS_TIMEOUT = 24 * 60 * 60
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2  # seconds, doubled at every attempt
+
+STATUS_PENDING = "pending"
+STATUS_FAILED = "failed"
+
+
+class InlineExecutor(object):
+    """
+    Runs push at once in current thread, countdown is ignored.
+    """
+    def apply_async(self, args=(), countdown=0):
+        run(*args)
+
+
+class ThreadExecutor(object):
+    """
+    Runs push at separate daemon thread after countdown. Thread is
+    started after current transaction commit if Django has commit hooks,
+    otherwise at once: pushed value is taken from cache, not from db.
+    """
+    def apply_async(self, args=(), countdown=0):
+        on_commit = getattr(transaction, "on_commit", None)  # Django 1.9+
+        timer = threading.Timer(countdown, self._run, args)
+        timer.daemon = True
+        if on_commit is not None:
+            on_commit(timer.start)
+        else:
+            timer.start()
+
+    @staticmethod
+    def _run(*args):
+        try:
+            run(*args)
+        finally:
+            connection.close()
+
+
+_EXECUTORS = {
+    "inline": InlineExecutor,
+    "thread": ThreadExecutor,
+}
+
+
+def get_executor():
+    name = getattr(settings, "NPOED_GRADING_FEATURES_SYNC_EXECUTOR", "thread")
+    if name in _EXECUTORS:
+        return _EXECUTORS[name]()
+    return import_string(name)
+
+
+def schedule(course_id, value):
+    """
+    Queues push of value for course. Returns False if push is already
+    queued, it will push the given value.
+    """
+    course_id = str(course_id)
+    cache.set(VALUE_KEY_BASE.format(course_id=course_id), bool(value), STATUS_TIMEOUT)
+    if not cache.add(PENDING_KEY_BASE.format(course_id=course_id), True, PENDING_TIMEOUT):
+        return False
+    _set_status(course_id, STATUS_PENDING, 0)
+    get_executor().apply_async(args=(course_id, 0), countdown=0)
+    return True
+
+
+def run(course_id, attempt=0):
+    """
+    Pushes last requested value to modulestore, queues retry if push failed.
+    If value is evicted from cache, db value is pushed.
+    """
+    from .models import NpoedGradingFeatures  # models use this module at save
+
+    cache.delete(PENDING_KEY_BASE.format(course_id=course_id))
+    value = cache.get(VALUE_KEY_BASE.format(course_id=course_id))
+    if value is None:
+        values = NpoedGradingFeatures.objects.filter(course_id=course_id).values_list('vertical_grading', flat=True)
+        if not values:
+            cache.delete(STATUS_KEY_BASE.format(course_id=course_id))
+            return
+        value = values[0]
+    if NpoedGradingFeatures._push_vertical_grading_to_modulestore(course_id, value):
+        cache.delete(STATUS_KEY_BASE.format(course_id=course_id))
+        return
+
+    attempt += 1
+    if attempt >= MAX_ATTEMPTS:
+        _set_status(course_id, STATUS_FAILED, attempt)
+        log.error("Vertical grading push for course '%s' failed %s times, giving up.", course_id, attempt)
+        return
+    if not cache.add(PENDING_KEY_BASE.format(course_id=course_id), True, PENDING_TIMEOUT):
+        # Newer push is already queued
+        return
+    _set_status(course_id, STATUS_PENDING, attempt)
+    get_executor().apply_async(args=(course_id, attempt), countdown=BACKOFF_BASE ** attempt)
+
+
+def get_status(course_id):
+    """
+    Returns (status, failed attempts) or None if course is in sync.
+    """
+    return cache.get(STATUS_KEY_BASE.format(course_id=str(course_id)))
+
+
+def _set_status(course_id, status, attempt):
+    cache.set(STATUS_KEY_BASE.format(course_id=course_id), (status, attempt), STATUS_TIMEOUT)
@@ -0,0 +1,77 @@
+"""
+Streaming reports over passing grade statuses. Rows are read with keyset
+pagination in fixed-size chunks, so memory doesn't depend on course size.
+"""
+import csv
+import json
+
+import six
+from django.contrib.auth.models import User
+
+from .models import CoursePassingGradeUserStatus
+
+CSV_COLUMNS = ("user_id", "username", "category", "threshold", "percent", "failed")
+
+
+def iter_passing_grade_report(course_key, chunk_size=1000):
+    """
+    Yields dict per user with passing grade status at course, ordered by user id:
+    {user_id, username, is_failed, categories: [{category, threshold, percent, failed}]}.
+    Categories of rows with legacy messages are [{'message': text, 'failed': failed}].
+    """
+    # Pages follow unique (course_id, user) index, so every chunk is an index range read
+    statuses = CoursePassingGradeUserStatus.objects.filter(course_id=str(course_key)).order_by('user_id')
+    last_user_id = 0
+    while True:
+        chunk = list(statuses.filter(user_id__gt=last_user_id).values_list(
+            'user_id', 'is_failed', 'category_results', 'status_messages'
+        )[:chunk_size])
+        if not chunk:
+            return
+        usernames = dict(User.objects.filter(id__in=[x[0] for x in chunk]).values_list('id', 'username'))
+        for user_id, is_failed, results, messages in chunk:
+            if results is not None:
+                categories = [
+                    {"category": category, "threshold": threshold, "percent": percent, "failed": percent < threshold}
+                    for category, threshold, percent in results
+                ]
+            else:
+                categories = [{"message": text, "failed": failed} for failed, text in (messages or [])]
+            yield {
+                "user_id": user_id,
+                "username": usernames.get(user_id),
+                "is_failed": is_failed,
+                "categories": categories,
+            }
+        last_user_id = chunk[-1][0]
+
+
+def write_jsonl(records, stream):
+    for record in records:
+        stream.write(json.dumps(record) + "\n")
+
+
+def write_csv(records, stream):
+    """
+    Writes row per user category. Legacy rows give one row per message with category
+    set to message text.
+    """
+    writer = csv.writer(stream)
+    writer.writerow(CSV_COLUMNS)
+    for record in records:
+        for category in record["categories"]:
+            writer.writerow([_encode(x) for x in (
+                record["user_id"],
+                record["username"],
+                category.get("category", category.get("message")),
+                category.get("threshold", ""),
+                category.get("percent", ""),
+                int(category["failed"]),
+            )])
+
+
+def _encode(value):
+    # python 2 csv module works with bytes only
+    if six.PY2 and isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
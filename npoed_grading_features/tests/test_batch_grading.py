@@ -0,0 +1,67 @@
+import random
+from unittest import TestCase, skipIf
+
+from ..batch_grading import BatchGrader, GradingPolicy, grade_learner, np
+
+
+GRADING_POLICY = {
+    "GRADER": [
+        {"type": "Homework", "min_count": 3, "drop_count": 2, "weight": 0.5, "passing_grade": 0.3},
+        {"type": "Lab", "min_count": 6, "drop_count": 0, "weight": 0.2, "passing_grade": 0},
+        {"type": "Exam", "min_count": 1, "drop_count": 0, "weight": 0.3, "passing_grade": 0.5},
+    ],
+    "GRADE_CUTOFFS": {"A": 0.9, "B": 0.75, "Pass": 0.5},
+}
+
+
+@skipIf(np is None, "numpy is not installed")
+class TestBatchGrader(TestCase):
+    """
+    Checks that batch grading gives exactly the same results as per-learner one
+    """
+    def setUp(self):
+        super(TestBatchGrader, self).setUp()
+        rnd = random.Random(0)
+        self.formats = [rnd.choice(["Homework", "Lab", "Exam", None]) for _ in range(40)]
+        self.weights = [rnd.choice([0, 1, 2, 5]) for _ in self.formats]
+        self.possible = [
+            [rnd.choice([0., 1., 2., 5.]) for _ in self.formats]
+            for _ in range(200)
+        ]
+        self.earned = [
+            [rnd.choice([0., possible, rnd.random() * possible]) for possible in row]
+            for row in self.possible
+        ]
+
+    def assert_same(self, grading_policy, formats, weights, passing_grade=True):
+        batch = BatchGrader(grading_policy, formats, weights, passing_grade).grade(self.earned, self.possible)
+        policy = GradingPolicy(grading_policy)
+        for learner, (earned, possible) in enumerate(zip(self.earned, self.possible)):
+            expected = grade_learner(policy, formats, weights, earned, possible, passing_grade)
+            self.assertEqual(batch['percent'][learner], expected['percent'])
+            self.assertEqual(batch['letter_grade'][learner], expected['letter_grade'])
+            self.assertEqual(bool(batch['passed'][learner]), expected['passed'])
+            for category, percent in expected['category_percents'].items():
+                self.assertEqual(batch['category_percents'][category][learner], percent)
+                self.assertEqual(batch['category_averages'][category][learner], expected['category_averages'][category])
+
+    def test_same_as_per_learner(self):
+        self.assert_same(GRADING_POLICY, self.formats, self.weights)
+
+    def test_passing_grade_disabled(self):
+        self.assert_same(GRADING_POLICY, self.formats, self.weights, passing_grade=False)
+
+    def test_single_item_with_drops(self):
+        formats = ["Exam" if x == "Exam" else None for x in self.formats]
+        policy = dict(GRADING_POLICY, GRADER=[
+            {"type": "Exam", "min_count": 1, "drop_count": 1, "weight": 1., "passing_grade": 0.5},
+        ])
+        self.assert_same(policy, formats, self.weights)
+
+    def test_equal_weights(self):
+        self.assert_same(GRADING_POLICY, self.formats, [1] * len(self.formats))
+
+    def test_shapes_are_checked(self):
+        grader = BatchGrader(GRADING_POLICY, self.formats, self.weights)
+        with self.assertRaises(ValueError):
+            grader.grade([[1.]], [[1.]])
@@ -0,0 +1,46 @@
+import itertools
+import random
+from unittest import TestCase
+
+from ..drops import find_drop_index, find_drop_indices, weighted_average
+
+
+class TestFindDropIndices(TestCase):
+    """
+    Checks optimal drop selection against brute force
+    """
+    def kept_average(self, percents, weights, dropped):
+        return weighted_average(percents, weights, [i for i in range(len(percents)) if i not in dropped])
+
+    def test_brute_force(self):
+        rnd = random.Random(0)
+        for _ in range(500):
+            length = rnd.randint(1, 7)
+            drop_count = rnd.randint(0, length)
+            percents = [rnd.choice([0., 0.5, 1., rnd.random()]) for _ in range(length)]
+            weights = [rnd.choice([0, 1, 2, rnd.randint(0, 10)]) for _ in range(length)]
+            best = max(
+                self.kept_average(percents, weights, dropped)
+                for dropped in itertools.combinations(range(length), drop_count)
+            )
+            dropped = find_drop_indices(percents, weights, drop_count)
+            self.assertEqual(len(dropped), drop_count)
+            self.assertAlmostEqual(self.kept_average(percents, weights, dropped), best)
+
+    def test_better_than_greedy(self):
+        # Greedy drops light 0.2 first, optimal keeps it and drops two heavier items
+        percents, weights = [0.2, 1., 0.5, 0.6], [1, 5, 2, 3]
+        self.assertEqual(find_drop_indices(percents, weights, 2), [2, 3])
+
+    def test_ties_drop_lower_indices(self):
+        self.assertEqual(find_drop_indices([0.5, 0.5, 0.5], [1, 1, 1], 2), [0, 1])
+        self.assertEqual(find_drop_indices([1., 0., 0.], [0, 0, 0], 1), [0])
+
+    def test_drop_count_bounds(self):
+        self.assertEqual(find_drop_indices([0.5, 1.], [1, 1], 0), [])
+        self.assertEqual(find_drop_indices([0.5, 1.], [1, 1], 3), [0, 1])
+
+    def test_single_weighted_item(self):
+        # Dropping item that carries all weight used to divide by zero
+        self.assertEqual(find_drop_index([1., 0.], [1, 0]), 1)
+        self.assertEqual(find_drop_indices([1., 0.], [1, 0], 1), [1])
@@ -0,0 +1,174 @@
+from unittest import TestCase
+
+from ..grading_core import (
+    Course, GradingPolicy, Problem, Subsection, Unit, course_from_tree, grade_course
+)
+
+
+def homework_policy(min_count=1, drop_count=0, passing_grade=0):
+    return GradingPolicy({
+        "GRADER": [
+            {"type": "Homework", "min_count": min_count, "drop_count": drop_count,
+             "weight": 1., "passing_grade": passing_grade},
+        ],
+        "GRADE_CUTOFFS": {"Pass": 0.5},
+    })
+
+
+class TestGradeCourse(TestCase):
+    """
+    Checks standalone grading with trees and expected grades of
+    edx grading tests (test_vertical_grading)
+    """
+    def assert_percent(self, tree, policy, vertical, sequential):
+        course = course_from_tree(tree)
+        self.assertEqual(grade_course(course, policy, vertical_mode=True).percent, vertical)
+        self.assertEqual(grade_course(course, policy, vertical_mode=False).percent, sequential)
+
+    def test_simple(self):
+        tree = {
+            "a": {
+                "b": ("Homework", {
+                    "c": (1., {"d": (0., 1.), "e": (1., 1.), "f": (None, None)}),
+                }),
+                "g": ("", {
+                    "h": (1., {"i": (0., 1.)}),
+                }),
+            }
+        }
+        self.assert_percent(tree, homework_policy(), 0.5, 0.5)
+
+    def test_has_zero_weights(self):
+        tree = {
+            "a": {
+                "b": ("Homework", {
+                    "c": (1., {"d": (0., 1.), "e": (0., 1.)}),
+                    "f": (0., {"g": (0., 1.), "h": (1., 1.)}),
+                    "i": (4., {"j": (1., 1.), "k": (1., 1.)}),
+                }),
+            }
+        }
+        self.assert_percent(tree, homework_policy(), 0.8, 0.5)
+
+    def test_several_assignment_categories(self):
+        tree = {
+            "a": {
+                "b": ("Homework", {
+                    "c": (1., {"d": (0., 1.), "e": (1., 1.)}),
+                    "c2": (0., {"d2": (0., 1.), "e2": (1., 1.)}),
+                }),
+                "f": ("Exam", {
+                    "g": (1., {"h": (1., 1.), "i": (1., 1.)}),
+                    "j": (3., {"k": (0., 1.), "l": (1., 1.)}),
+                }),
+            }
+        }
+        policy = GradingPolicy({
+            "GRADER": [
+                {"type": "Homework", "min_count": 1, "drop_count": 0, "weight": 0.4},
+                {"type": "Exam", "min_count": 1, "drop_count": 0, "weight": 0.6},
+            ],
+            "GRADE_CUTOFFS": {"Pass": 0.5},
+        })
+        vertical = 0.4 * 0.5 + 0.6 * ((1. * 1 + .5 * 3) / 4)
+        sequential = 0.4 * .5 + 0.6 * 0.75
+        self.assert_percent(tree, policy, round(vertical + 0.05 / 100, 2), round(sequential + 0.05 / 100, 2))
+
+    def test_droppable_subsections(self):
+        tree = {
+            "a": {
+                "b1": ("Homework", {
+                    "c1": (1., {"d1": (0., 1.), "e1": (0., 1.)}),
+                    "f1": (4., {"g1": (1., 1.), "h1": (1., 1.)}),
+                }),
+                "b2": ("Homework", {
+                    "c2": (1., {"d2": (1., 1.), "e2": (1., 1.)}),
+                    "f2": (4., {"g2": (1., 1.), "h2": (0., 1.)}),
+                }),
+                "b3": ("Homework", {
+                    "c3": (1., {"d3": (0., 1.), "e3": (1., 1.)}),
+                    "f3": (4., {"g3": (0., 1.), "h3": (0., 1.)}),
+                }),
+            }
+        }
+        # Units f2 and f3 are dropped
+        vertical = (4 * 1 + 1 * 1 + 1 * 0.5) / (1 + 4 + 1 + 1)
+        self.assert_percent(tree, homework_policy(drop_count=2), round(vertical + 0.05 / 100, 2), 0.75)
+
+    def test_drop_last_element(self):
+        tree = {
+            "a": {
+                "b1": ("Homework", {
+                    "c1": (1., {"d1": (1., 1.), "e1": (0., 1.)}),
+                }),
+            }
+        }
+        self.assert_percent(tree, homework_policy(min_count=0, drop_count=1), 0, 0)
+        self.assert_percent(tree, homework_policy(min_count=1, drop_count=1), 0, 0)
+
+    def test_drop_optimal(self):
+        tree = {
+            "a": {
+                "b1": ("Homework", {
+                    "c1": (1., {"d1": (1., 1.), "e1": (1., 1.)}),
+                }),
+                "b2": ("Homework", {
+                    "c2": (1., {"d2": (1., 1.), "e2": (1., 1.)}),
+                    "c3": (1., {"d3": (0., 1.)}),
+                    "c4": (4., {"d4": (1., 1.), "e41": (0., 1.), "e42": (0., 1.), "e43": (0., 1.)}),
+                }),
+            }
+        }
+        vertical = round((1. * 1 + 1 * 1 + 0 * 1) / (1 + 1 + 1) + 0.05 / 100, 2)
+        self.assert_percent(tree, homework_policy(min_count=0, drop_count=1), vertical, 1)
+
+    def test_min_count_padding(self):
+        course = Course([Subsection("Homework", [Unit(1, [Problem(1, 1)])])])
+        policy = homework_policy(min_count=4, drop_count=1)
+        self.assertEqual(grade_course(course, policy, vertical_mode=True).percent, 1)
+        self.assertEqual(grade_course(course, policy, vertical_mode=False).percent, 0.33)
+
+
+class TestPassingGrade(TestCase):
+    """
+    Checks that category passing grade fails the course
+    """
+    def setUp(self):
+        super(TestPassingGrade, self).setUp()
+        self.course = Course([
+            Subsection("Homework", [Unit(1, [Problem(1, 1)]), Unit(1, [Problem(0, 1)])]),
+            Subsection("Homework", [Unit(1, [Problem(1, 1)])]),
+        ])
+
+    def test_passed(self):
+        for vertical_mode in (True, False):
+            result = grade_course(self.course, homework_policy(passing_grade=0.5), vertical_mode)
+            self.assertTrue(result.passed)
+            self.assertEqual(result.letter_grade, "Pass")
+
+    def test_category_not_passed(self):
+        for vertical_mode, average in ((True, 2. / 3), (False, 0.75)):
+            result = grade_course(self.course, homework_policy(passing_grade=0.8), vertical_mode)
+            self.assertFalse(result.passed)
+            self.assertIsNone(result.letter_grade)
+            self.assertEqual(result.category_averages["Homework"], average)
+
+    def test_passing_grade_disabled(self):
+        result = grade_course(self.course, homework_policy(passing_grade=0.8), passing_grade=False)
+        self.assertTrue(result.passed)
+        self.assertEqual(result.letter_grade, "Pass")
+
+    def test_average_without_drops(self):
+        # Vertical mode drops the failed unit for percent, but checks average of all units
+        result = grade_course(self.course, homework_policy(drop_count=1, passing_grade=0.8), vertical_mode=True)
+        self.assertEqual(result.percent, 1)
+        self.assertEqual(result.category_averages["Homework"], 2. / 3)
+        self.assertFalse(result.passed)
+
+    def test_zero_weight_unit_is_averaged(self):
+        # Zero weight unit doesn't change percent, but counts for passing grade
+        course = Course([Subsection("Homework", [Unit(1, [Problem(1, 1)]), Unit(0, [Problem(0, 1)])])])
+        result = grade_course(course, homework_policy(passing_grade=0.8), vertical_mode=True)
+        self.assertEqual(result.percent, 1)
+        self.assertEqual(result.category_averages["Homework"], 0.5)
+        self.assertFalse(result.passed)
@@ -0,0 +1,338 @@
+import json
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, override_settings
+from mock import Mock, patch
+from openedx.core.djangoapps.request_cache import get_cache as get_request_cache
+from student.tests.factories import UserFactory
+
+from .. import modulestore_sync
+from ..models import NpoedGradingFeatures, CoursePassingGradeUserStatus, DEFAULT_FLAGS
+
+
+@override_settings(NPOED_GRADING_FEATURES_SYNC_EXECUTOR="inline")
+class TestGradingFeaturesCache(TestCase):
+    """
+    Checks that feature flags lookups are served from cache
+    """
+    COURSE_ID = "course-v1:org+course+run"
+
+    def setUp(self):
+        super(TestGradingFeaturesCache, self).setUp()
+        cache.clear()
+        NpoedGradingFeatures._local_cache.clear()
+        push_patcher = patch.object(NpoedGradingFeatures, '_push_vertical_grading_to_modulestore', return_value=True)
+        push_patcher.start()
+        self.addCleanup(push_patcher.stop)
+
+    def test_absent_row_is_cached(self):
+        self.assertFalse(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+        with self.assertNumQueries(0):
+            self.assertFalse(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+            self.assertFalse(NpoedGradingFeatures.is_vertical_grading_enabled(self.COURSE_ID))
+            self.assertIsNone(NpoedGradingFeatures.get(self.COURSE_ID, allow_cached=True))
+
+    def test_switch_invalidates_absent_marker(self):
+        self.assertFalse(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+        NpoedGradingFeatures.enable_passing_grade(self.COURSE_ID)
+        with self.assertNumQueries(0):
+            self.assertTrue(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+
+    def test_delete_sets_absent_marker(self):
+        NpoedGradingFeatures.enable_passing_grade(self.COURSE_ID)
+        NpoedGradingFeatures.objects.filter(course_id=self.COURSE_ID).delete()
+        with self.assertNumQueries(0):
+            self.assertFalse(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+
+    def test_local_cache_skips_shared_cache(self):
+        NpoedGradingFeatures.enable_passing_grade(self.COURSE_ID)
+        self.assertTrue(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+        with patch.object(cache, 'get') as cache_get:
+            self.assertTrue(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+            self.assertFalse(cache_get.called)
+
+    def test_generation_change_is_seen_after_local_timeout(self):
+        NpoedGradingFeatures.enable_passing_grade(self.COURSE_ID)
+        self.assertTrue(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+        # Imitate flip at another process: shared cache is updated, local one is not
+        local_entry = NpoedGradingFeatures._local_cache.get(self.COURSE_ID)
+        NpoedGradingFeatures.disable_passing_grade(self.COURSE_ID)
+        NpoedGradingFeatures._local_cache.set(self.COURSE_ID, local_entry)
+        self.assertTrue(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+
+        with patch('npoed_grading_features.local_cache.time.time', return_value=float('inf')):
+            self.assertFalse(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+
+    def test_flags_are_reread_after_max_age(self):
+        NpoedGradingFeatures.enable_passing_grade(self.COURSE_ID)
+        self.assertTrue(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+        local_entry = NpoedGradingFeatures._local_cache.get(self.COURSE_ID)
+        NpoedGradingFeatures.disable_passing_grade(self.COURSE_ID)
+        # Flip at another process, then generation key is evicted from shared cache
+        cache.delete(NpoedGradingFeatures.GENERATION_KEY_BASE.format(course_id=self.COURSE_ID))
+        NpoedGradingFeatures._local_cache.set(self.COURSE_ID, (None, local_entry[1]))
+
+        now = time.time()
+        with patch('npoed_grading_features.local_cache.time.time', return_value=now + NpoedGradingFeatures.LOCAL_TIMEOUT + 1):
+            self.assertTrue(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+        with patch('npoed_grading_features.local_cache.time.time', return_value=now + NpoedGradingFeatures.LOCAL_MAX_AGE + 1):
+            self.assertFalse(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+
+    def test_get_many(self):
+        other_course_id = "course-v1:org+other+run"
+        NpoedGradingFeatures.enable_vertical_grading(other_course_id)
+        cache.clear()
+        with self.assertNumQueries(1):
+            flags = NpoedGradingFeatures.get_many([self.COURSE_ID, other_course_id])
+        self.assertEqual(flags[self.COURSE_ID], DEFAULT_FLAGS)
+        self.assertTrue(flags[other_course_id].vertical_grading)
+        with self.assertNumQueries(0):
+            self.assertEqual(NpoedGradingFeatures.get_many([self.COURSE_ID, other_course_id]), flags)
+
+    def test_legacy_json_cache_entry(self):
+        key = NpoedGradingFeatures.LEGACY_KEY_BASE.format(course_id=self.COURSE_ID)
+        cache.set(key, json.dumps({
+            "course_id": self.COURSE_ID,
+            "passing_grade": True,
+            "vertical_grading": False,
+            "problem_best_score": True
+        }))
+        with self.assertNumQueries(0):
+            self.assertTrue(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+            self.assertTrue(NpoedGradingFeatures.is_problem_best_score_enabled(self.COURSE_ID))
+            self.assertFalse(NpoedGradingFeatures.is_vertical_grading_enabled(self.COURSE_ID))
+
+    def test_legacy_key_is_not_written(self):
+        legacy_key = NpoedGradingFeatures.LEGACY_KEY_BASE.format(course_id=self.COURSE_ID)
+        self.assertFalse(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+        self.assertIsNone(cache.get(legacy_key))
+
+        # Change drops entry written by previous version, so that it can't be stale
+        cache.set(legacy_key, json.dumps({"passing_grade": False}))
+        NpoedGradingFeatures.enable_passing_grade(self.COURSE_ID)
+        self.assertIsNone(cache.get(legacy_key))
+        self.assertTrue(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+
+
+@override_settings(NPOED_GRADING_FEATURES_SYNC_EXECUTOR="inline")
+class TestGradingFeaturesModulestorePush(TestCase):
+    """
+    Checks that course at modulestore is updated only when vertical_grading changes
+    """
+    COURSE_ID = "course-v1:org+course+run"
+
+    def setUp(self):
+        super(TestGradingFeaturesModulestorePush, self).setUp()
+        cache.clear()
+
+    @patch.object(NpoedGradingFeatures, '_push_vertical_grading_to_modulestore', return_value=True)
+    def test_push_only_on_vertical_grading_change(self, push):
+        self.assertTrue(NpoedGradingFeatures.enable_vertical_grading(self.COURSE_ID))
+        self.assertEqual(push.call_count, 1)
+
+        self.assertFalse(NpoedGradingFeatures.enable_passing_grade(self.COURSE_ID))
+        self.assertFalse(NpoedGradingFeatures.enable_vertical_grading(self.COURSE_ID))
+        self.assertEqual(push.call_count, 1)
+
+        self.assertTrue(NpoedGradingFeatures.disable_vertical_grading(self.COURSE_ID))
+        push.assert_called_with(self.COURSE_ID, False)
+
+    @patch.object(NpoedGradingFeatures, '_push_vertical_grading_to_modulestore', return_value=False)
+    def test_failed_push_is_retried(self, push):
+        NpoedGradingFeatures.enable_vertical_grading(self.COURSE_ID)
+        self.assertEqual(push.call_count, modulestore_sync.MAX_ATTEMPTS)
+        self.assertEqual(
+            modulestore_sync.get_status(self.COURSE_ID),
+            (modulestore_sync.STATUS_FAILED, modulestore_sync.MAX_ATTEMPTS)
+        )
+
+    @patch('npoed_grading_features.models.modulestore')
+    def test_push_skips_course_with_same_value(self, modulestore):
+        store = modulestore.return_value
+        store.get_course.return_value = Mock(vertical_grading=False)
+        self.assertTrue(NpoedGradingFeatures._push_vertical_grading_to_modulestore(self.COURSE_ID, False))
+        self.assertFalse(store.update_item.called)
+
+        self.assertTrue(NpoedGradingFeatures._push_vertical_grading_to_modulestore(self.COURSE_ID, True))
+        self.assertEqual(store.update_item.call_count, 1)
+
+    def test_pushes_are_coalesced(self):
+        with patch.object(modulestore_sync.InlineExecutor, 'apply_async') as apply_async:
+            NpoedGradingFeatures.enable_vertical_grading(self.COURSE_ID)
+            NpoedGradingFeatures.disable_vertical_grading(self.COURSE_ID)
+            self.assertEqual(apply_async.call_count, 1)
+        self.assertEqual(modulestore_sync.get_status(self.COURSE_ID), (modulestore_sync.STATUS_PENDING, 0))
+
+    @patch.object(modulestore_sync, 'run')
+    def test_thread_executor_without_commit_hooks(self, run):
+        # Django 1.8: push is never run inline, thread takes value from cache
+        with patch.object(modulestore_sync.transaction, 'on_commit', None, create=True):
+            with patch.object(modulestore_sync.threading, 'Timer') as timer:
+                modulestore_sync.ThreadExecutor().apply_async(args=(self.COURSE_ID, 0))
+        self.assertFalse(run.called)
+        timer.return_value.start.assert_called_once_with()
+
+    @patch.object(NpoedGradingFeatures, '_push_vertical_grading_to_modulestore', return_value=True)
+    def test_requested_value_is_pushed(self, push):
+        # Row isn't committed (or is rolled back) yet, pushed value doesn't depend on db
+        NpoedGradingFeatures.objects.create(course_id=self.COURSE_ID)
+        with patch.object(modulestore_sync.InlineExecutor, 'apply_async'):
+            modulestore_sync.schedule(self.COURSE_ID, True)
+        modulestore_sync.run(self.COURSE_ID)
+        push.assert_called_with(self.COURSE_ID, True)
+
+    def test_switch_updates_single_column(self):
+        NpoedGradingFeatures.enable_passing_grade(self.COURSE_ID)
+        stale = NpoedGradingFeatures.objects.get(course_id=self.COURSE_ID)
+        with self.assertNumQueries(1):
+            NpoedGradingFeatures.enable_problem_best_score_grade(self.COURSE_ID)
+        NpoedGradingFeatures.disable_passing_grade(self.COURSE_ID)
+        stale.refresh_from_db()
+        self.assertEqual((stale.passing_grade, stale.problem_best_score), (False, True))
+        self.assertTrue(NpoedGradingFeatures.is_problem_best_score_enabled(self.COURSE_ID))
+        self.assertFalse(NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID))
+
+
+    def test_switch_with_concurrently_created_row(self):
+        @contextmanager
+        def atomic_after_concurrent_insert():
+            # Other request creates row between UPDATE and INSERT
+            NpoedGradingFeatures.objects.bulk_create([NpoedGradingFeatures(course_id=self.COURSE_ID, passing_grade=True)])
+            with transaction.atomic():
+                yield
+
+        with patch('npoed_grading_features.models.transaction', Mock(atomic=atomic_after_concurrent_insert)):
+            NpoedGradingFeatures.enable_problem_best_score_grade(self.COURSE_ID)
+        row = NpoedGradingFeatures.objects.get(course_id=self.COURSE_ID)
+        self.assertEqual((row.passing_grade, row.problem_best_score), (True, True))
+        self.assertTrue(NpoedGradingFeatures.is_problem_best_score_enabled(self.COURSE_ID))
+
+
+@override_settings(NPOED_GRADING_FEATURES_SYNC_EXECUTOR="inline")
+class TestPassingGradeUserStatus(TestCase):
+    """
+    Checks passing grade status storage
+    """
+    COURSE_ID = "course-v1:org+course+run"
+    RESULTS = [("Homework", 0.5, 0.2), ("Exam", 0.3, 0.4)]
+    MESSAGES = [
+        (True, "You must earn 50% (got 20%) for Homework."),
+        (False, "You must earn 30% (got 40%) for Exam.")
+    ]
+    NEW_RESULTS = [("Homework", 0.5, 0.6), ("Exam", 0.3, 0.4)]
+
+    def setUp(self):
+        super(TestPassingGradeUserStatus, self).setUp()
+        cache.clear()
+        get_request_cache(CoursePassingGradeUserStatus.REQUEST_CACHE_NAME).clear()
+        NpoedGradingFeatures._local_cache.clear()
+        push_patcher = patch.object(NpoedGradingFeatures, '_push_vertical_grading_to_modulestore', return_value=True)
+        push_patcher.start()
+        self.addCleanup(push_patcher.stop)
+        NpoedGradingFeatures.enable_passing_grade(self.COURSE_ID)
+        self.user = UserFactory()
+
+    def test_status_is_stored_structured(self):
+        CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, self.user, self.RESULTS)
+        row = CoursePassingGradeUserStatus.objects.get(course_id=self.COURSE_ID, user=self.user)
+        self.assertEqual(row.category_results, [list(x) for x in self.RESULTS])
+        self.assertTrue(row.is_failed)
+        self.assertEqual(row.failed_mask, 1)
+        self.assertEqual(
+            CoursePassingGradeUserStatus.get_passing_grade_status(self.COURSE_ID, self.user),
+            self.MESSAGES
+        )
+        self.assertTrue(CoursePassingGradeUserStatus.is_passing_grade_failed(self.COURSE_ID, self.user))
+
+    def test_legacy_messages(self):
+        CoursePassingGradeUserStatus.objects.create(
+            course_id=self.COURSE_ID, user=self.user, status_messages=self.MESSAGES
+        )
+        self.assertEqual(
+            CoursePassingGradeUserStatus.get_passing_grade_status(self.COURSE_ID, self.user),
+            [list(x) for x in self.MESSAGES]
+        )
+        self.assertTrue(CoursePassingGradeUserStatus.is_passing_grade_failed(self.COURSE_ID, self.user))
+
+    def test_unchanged_status_is_not_written(self):
+        self.assertTrue(CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, self.user, self.RESULTS))
+        with self.assertNumQueries(0):
+            self.assertFalse(
+                CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, self.user, self.RESULTS)
+            )
+
+        cache.clear()
+        NpoedGradingFeatures._local_cache.clear()
+        row = CoursePassingGradeUserStatus.objects.get(course_id=self.COURSE_ID, user=self.user)
+        with self.assertNumQueries(1):  # feature flag only
+            self.assertFalse(CoursePassingGradeUserStatus.set_passing_grade_status(
+                self.COURSE_ID, self.user, self.RESULTS, row=row
+            ))
+
+    def test_changed_status_is_written(self):
+        CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, self.user, self.RESULTS)
+        self.assertTrue(
+            CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, self.user, self.NEW_RESULTS)
+        )
+        row = CoursePassingGradeUserStatus.objects.get(course_id=self.COURSE_ID, user=self.user)
+        self.assertEqual(row.category_results, [list(x) for x in self.NEW_RESULTS])
+        self.assertFalse(row.is_failed)
+
+    def test_batch(self):
+        users = [self.user, UserFactory(), UserFactory()]
+        CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, users[0], self.RESULTS)
+        with CoursePassingGradeUserStatus.batch(self.COURSE_ID):
+            with self.assertNumQueries(0):
+                for user in users:
+                    CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, user, self.NEW_RESULTS)
+                self.assertFalse(CoursePassingGradeUserStatus.is_passing_grade_failed(self.COURSE_ID, users[1]))
+            self.assertFalse(CoursePassingGradeUserStatus.objects.filter(user=users[1]).exists())
+        rows = CoursePassingGradeUserStatus.objects.filter(course_id=self.COURSE_ID)
+        self.assertEqual(rows.count(), 3)
+        for row in rows:
+            self.assertEqual(row.category_results, [list(x) for x in self.NEW_RESULTS])
+            self.assertEqual(row.status_digest, CoursePassingGradeUserStatus.get_digest(self.NEW_RESULTS))
+            self.assertFalse(row.is_failed)
+        # Batch statuses are written to shared cache only, stale request cache values are dropped
+        request_cache = get_request_cache(CoursePassingGradeUserStatus.REQUEST_CACHE_NAME)
+        for user in users:
+            key = CoursePassingGradeUserStatus.KEY_BASE.format(course_id=self.COURSE_ID, user_id=user.id)
+            self.assertNotIn(key, request_cache)
+            self.assertIsNotNone(cache.get(key))
+
+    def test_batch_is_flushed_on_error(self):
+        with self.assertRaises(ValueError):
+            with CoursePassingGradeUserStatus.batch(self.COURSE_ID):
+                CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, self.user, self.RESULTS)
+                raise ValueError
+        row = CoursePassingGradeUserStatus.objects.get(course_id=self.COURSE_ID, user=self.user)
+        self.assertEqual(row.category_results, [list(x) for x in self.RESULTS])
+
+    def test_status_read_is_cached(self):
+        CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, self.user, self.RESULTS)
+        cache.clear()
+        get_request_cache(CoursePassingGradeUserStatus.REQUEST_CACHE_NAME).clear()
+        NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID)
+        with self.assertNumQueries(1):
+            for _ in range(2):
+                messages = CoursePassingGradeUserStatus.get_passing_grade_status(self.COURSE_ID, self.user)
+        self.assertEqual(messages, self.MESSAGES)
+
+        get_request_cache(CoursePassingGradeUserStatus.REQUEST_CACHE_NAME).clear()
+        with self.assertNumQueries(0):
+            CoursePassingGradeUserStatus.get_passing_grade_status(self.COURSE_ID, self.user)
+
+        CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, self.user, self.NEW_RESULTS)
+        with self.assertNumQueries(0):
+            self.assertFalse(CoursePassingGradeUserStatus.is_passing_grade_failed(self.COURSE_ID, self.user))
+
+    def test_failed_many(self):
+        users = [self.user, UserFactory(), UserFactory()]
+        CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, users[0], self.RESULTS)
+        CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, users[1], self.NEW_RESULTS)
+        with self.assertNumQueries(1):
+            failed = CoursePassingGradeUserStatus.get_passing_grade_failed_many(self.COURSE_ID, users)
+        self.assertEqual(failed, {users[0].id: True, users[1].id: False, users[2].id: False})
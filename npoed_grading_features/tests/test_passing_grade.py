@@ -0,0 +1,152 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from mock import Mock, patch
+from openedx.core.djangoapps.request_cache import get_cache as get_request_cache
+from student.tests.factories import UserFactory
+
+from ..enable_passing_grade import PassingGradePolicy, build_course_grade, build_is_course_passed
+from ..models import NpoedGradingFeatures, CoursePassingGradeUserStatus
+
+GRADING_POLICY = {
+    "GRADER": [
+        {"type": "Homework", "min_count": 1, "drop_count": 0, "weight": 0.5, "passing_grade": 0.3},
+        {"type": "Exam", "min_count": 1, "drop_count": 0, "weight": 0.5, "passing_grade": 0},
+    ],
+    "GRADE_CUTOFFS": {"A": 0.9, "Pass": 0.5, "Zero": 0},
+}
+
+
+def get_course_data(grading_policy=GRADING_POLICY, version="v1"):
+    return Mock(course=Mock(id="course-v1:org+course+run", grading_policy=grading_policy), version=version)
+
+
+class TestPassingGradePolicy(TestCase):
+    """
+    Checks that passing grade policy is compiled once per course policy version
+    """
+    def setUp(self):
+        super(TestPassingGradePolicy, self).setUp()
+        PassingGradePolicy._compiled.clear()
+
+    def test_compiled_policy(self):
+        policy = PassingGradePolicy.for_course(get_course_data())
+        self.assertEqual(policy.checked_categories, ("Homework",))
+        self.assertEqual(policy.thresholds, {"Homework": 0.3, "Exam": 0})
+        self.assertEqual(policy.descending_grades, ["A", "Pass", "Zero"])
+        self.assertEqual(policy.success_cutoff, 0.5)
+
+    def test_cached_by_version(self):
+        policy = PassingGradePolicy.for_course(get_course_data())
+        self.assertIs(PassingGradePolicy.for_course(get_course_data()), policy)
+        self.assertIsNot(PassingGradePolicy.for_course(get_course_data(version="v2")), policy)
+
+    def test_cached_by_policy_without_version(self):
+        policy = PassingGradePolicy.for_course(get_course_data(version=None))
+        self.assertIs(PassingGradePolicy.for_course(get_course_data(version=None)), policy)
+        changed = dict(GRADING_POLICY, GRADE_CUTOFFS={"Pass": 0.6})
+        changed_policy = PassingGradePolicy.for_course(get_course_data(changed, version=None))
+        self.assertEqual(changed_policy.success_cutoff, 0.6)
+
+
+@patch.object(NpoedGradingFeatures, 'is_passing_grade_enabled', return_value=True)
+class TestCourseGradeSummary(TestCase):
+    """
+    Checks that summary with passing grade marks is memoized at CourseGrade
+    """
+    def setUp(self):
+        super(TestCourseGradeSummary, self).setUp()
+        PassingGradePolicy._compiled.clear()
+
+        class CourseGrade(object):
+            summary_calls = 0
+
+            def __init__(self, course_data, grader_result):
+                self.course_data = course_data
+                self.grader_result = grader_result
+                self.passed = False
+
+            @property
+            def summary(self):
+                CourseGrade.summary_calls += 1
+                return {"section_breakdown": self.grader_result["section_breakdown"]}
+
+            def _compute_passed(self, grade_cutoffs, percent):
+                return True
+
+            def _compute_letter_grade(self, grade_cutoffs, percent):
+                return None
+
+        self.course_grade_class = build_course_grade(CourseGrade)
+
+    def get_grader_result(self, homework_percent):
+        return {"section_breakdown": [
+            {"category": "Homework", "percent": homework_percent, "prominent": True},
+            {"category": "Exam", "percent": 1., "prominent": True},
+        ]}
+
+    def test_summary_is_memoized(self, is_enabled):
+        course_grade = self.course_grade_class(get_course_data(), self.get_grader_result(0.2))
+        summary = course_grade.summary
+        self.assertIs(course_grade.summary, summary)
+        self.assertEqual(self.course_grade_class.summary_calls, 1)
+        self.assertEqual(is_enabled.call_count, 1)
+        homework, exam = summary["section_breakdown"]
+        self.assertIn("mark", homework)
+        self.assertNotIn("mark", exam)
+
+    def test_summary_is_recomputed_for_new_grader_result(self, _):
+        course_grade = self.course_grade_class(get_course_data(), self.get_grader_result(0.2))
+        summary = course_grade.summary
+        course_grade.grader_result = self.get_grader_result(0.4)
+        self.assertIsNot(course_grade.summary, summary)
+        self.assertEqual(self.course_grade_class.summary_calls, 2)
+        self.assertNotIn("mark", course_grade.summary["section_breakdown"][0])
+
+
+@override_settings(NPOED_GRADING_FEATURES_SYNC_EXECUTOR="inline")
+class TestIsCoursePassedBulk(TestCase):
+    """
+    Checks that is_course_passed.bulk gives the same results as per-student calls
+    """
+    COURSE_ID = "course-v1:org+course+run"
+    FAILED_RESULTS = [("Homework", 0.5, 0.2)]
+    PASSED_RESULTS = [("Homework", 0.5, 0.6)]
+
+    def setUp(self):
+        super(TestIsCoursePassedBulk, self).setUp()
+        cache.clear()
+        NpoedGradingFeatures._local_cache.clear()
+        push_patcher = patch.object(NpoedGradingFeatures, '_push_vertical_grading_to_modulestore', return_value=True)
+        push_patcher.start()
+        self.addCleanup(push_patcher.stop)
+        NpoedGradingFeatures.enable_passing_grade(self.COURSE_ID)
+        self.course = Mock(id=self.COURSE_ID)
+        self.students = [UserFactory() for _ in range(4)]
+        CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, self.students[0], self.FAILED_RESULTS)
+        CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, self.students[1], self.PASSED_RESULTS)
+        CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, self.students[2], self.PASSED_RESULTS)
+        # Edx check fails third student, fourth one has no status
+        failed_by_edx = self.students[2].id
+
+        def is_course_passed(course, grade_summary=None, student=None, request=None):
+            return student.id != failed_by_edx
+        self.is_course_passed = build_is_course_passed(is_course_passed)
+
+    def assert_same_as_single(self, expected):
+        cache.clear()
+        get_request_cache(CoursePassingGradeUserStatus.REQUEST_CACHE_NAME).clear()
+        enabled = NpoedGradingFeatures.is_passing_grade_enabled(self.COURSE_ID)
+        # Statuses of all students are read with one query, flags are cached
+        with self.assertNumQueries(1 if enabled else 0):
+            passed = self.is_course_passed.bulk(self.course, self.students)
+        self.assertEqual(passed, dict(
+            (student.id, self.is_course_passed(self.course, student=student)) for student in self.students
+        ))
+        self.assertEqual([passed[student.id] for student in self.students], expected)
+
+    def test_feature_enabled(self):
+        self.assert_same_as_single([False, True, False, True])
+
+    def test_feature_disabled(self):
+        NpoedGradingFeatures.disable_passing_grade(self.COURSE_ID)
+        self.assert_same_as_single([True, True, False, True])
@@ -0,0 +1,204 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from mock import Mock, patch
+from opaque_keys.edx.locator import CourseLocator
+from courseware.models import StudentModule, StudentModuleHistory
+from student.tests.factories import UserFactory
+
+from ..enable_problem_best_score import (
+    set_score, update_best_score, build_score_published_handler, get_avoided_regrades_count,
+    iter_best_score_rescore, set_scores_bulk, _get_history_models
+)
+from ..models import NpoedGradingFeatures
+
+
+def get_history_grades(user, usage_key):
+    """
+    Returns history grades of module, in order of writing
+    """
+    grades = []
+    for history_model in _get_history_models():
+        grades.extend(history_model.objects.filter(
+            student_module__student=user, student_module__module_state_key=usage_key
+        ).order_by('id').values_list('grade', flat=True))
+    return grades
+
+
+class TestUpdateBestScore(TestCase):
+    """
+    Checks that best score is written with guarded update and is never lowered.
+    """
+    def setUp(self):
+        super(TestUpdateBestScore, self).setUp()
+        self.user = UserFactory.create()
+        self.usage_key = CourseLocator("org", "course", "run").make_usage_key("problem", "p1")
+
+    def get_score(self):
+        module = StudentModule.objects.get(student=self.user, module_state_key=self.usage_key)
+        return module.grade, module.max_grade
+
+    def test_new_score_is_inserted(self):
+        changed, modified = update_best_score(self.user.id, self.usage_key, 1, 5)
+        self.assertTrue(changed)
+        self.assertIsNotNone(modified)
+        self.assertEqual(self.get_score(), (1, 5))
+
+    def test_rising_score_is_written_with_history(self):
+        update_best_score(self.user.id, self.usage_key, 1, 5)
+        changed, _ = update_best_score(self.user.id, self.usage_key, 3, 5)
+        self.assertTrue(changed)
+        self.assertEqual(self.get_score(), (3, 5))
+        self.assertEqual(get_history_grades(self.user, self.usage_key), [1, 3])
+
+    def test_lower_score_is_ignored(self):
+        _, modified = update_best_score(self.user.id, self.usage_key, 3, 5)
+        with self.assertNumQueries(2):
+            changed, unchanged_modified = update_best_score(self.user.id, self.usage_key, 1, 5)
+        self.assertFalse(changed)
+        self.assertEqual(unchanged_modified, modified)
+        self.assertEqual(self.get_score(), (3, 5))
+        self.assertEqual(get_history_grades(self.user, self.usage_key), [3])
+
+    def test_max_score_change_is_written(self):
+        update_best_score(self.user.id, self.usage_key, 3, 5)
+        changed, _ = update_best_score(self.user.id, self.usage_key, 1, 10)
+        self.assertTrue(changed)
+        self.assertEqual(self.get_score(), (1, 10))
+
+    def test_set_score_returns_modified(self):
+        modified = set_score(self.user.id, self.usage_key, 2, 5)
+        self.assertEqual(modified, StudentModule.objects.get(student=self.user).modified)
+
+
+@patch.object(NpoedGradingFeatures, 'is_problem_best_score_enabled', return_value=True)
+class TestScorePublishedHandler(TestCase):
+    """
+    Checks that edx score handler is skipped if best score is unchanged.
+    """
+    def setUp(self):
+        super(TestScorePublishedHandler, self).setUp()
+        cache.clear()
+        self.user = UserFactory.create()
+        self.usage_key = CourseLocator("org", "course", "run").make_usage_key("problem", "p1")
+        self.block = Mock(location=self.usage_key)
+        self.modified = []
+
+        def score_published_handler(sender, block, user, raw_earned, raw_possible, only_if_higher, **kwargs):
+            if only_if_higher:
+                module = StudentModule.objects.get(student=user, module_state_key=block.location)
+                # Simplified edx higher-or-equal check
+                if float(raw_earned) / raw_possible < float(module.grade) / module.max_grade:
+                    return False
+            self.modified.append(set_score(user.id, block.location, raw_earned, raw_possible))
+            return True
+        self.handler = build_score_published_handler(score_published_handler)
+
+    def publish(self, raw_earned, raw_possible, only_if_higher=False):
+        return self.handler(
+            sender=None, block=self.block, user=self.user,
+            raw_earned=raw_earned, raw_possible=raw_possible, only_if_higher=only_if_higher
+        )
+
+    def test_changed_score_is_written_once(self, _):
+        self.assertTrue(self.publish(1, 5))
+        self.assertTrue(self.publish(3, 5))
+        self.assertEqual(get_history_grades(self.user, self.usage_key), [1, 3])
+        self.assertEqual(len(self.modified), 2)
+        self.assertEqual(self.modified[-1], StudentModule.objects.get(student=self.user).modified)
+
+    def test_unchanged_score_skips_handler(self, _):
+        self.publish(3, 5)
+        self.assertFalse(self.publish(1, 5))
+        self.assertFalse(self.publish(3, 5))
+        self.assertEqual(len(self.modified), 1)
+        self.assertEqual(get_avoided_regrades_count(self.usage_key.course_key), 2)
+
+    def test_only_if_higher_is_checked_by_edx(self, _):
+        self.publish(3, 5)
+        # Max score is changed, but ratio is lower: edx keeps old score
+        self.assertFalse(self.publish(4, 10, only_if_higher=True))
+        self.assertEqual(StudentModule.objects.get(student=self.user).grade, 3)
+        self.assertTrue(self.publish(8, 10, only_if_higher=True))
+        self.assertEqual(StudentModule.objects.get(student=self.user).grade, 8)
+
+
+class TestBestScoreRescore(TestCase):
+    """
+    Checks that scores are raised to the best ones from module history.
+    """
+    def setUp(self):
+        super(TestBestScoreRescore, self).setUp()
+        self.course_key = CourseLocator("org", "course", "run")
+        self.users = [UserFactory.create() for _ in range(3)]
+
+    def create_module(self, user, problem, history):
+        """
+        history is list of (grade, max_grade), last one is current
+        """
+        grade, max_grade = history[-1]
+        module = StudentModule.objects.create(
+            student=user, course_id=self.course_key, module_type="problem",
+            module_state_key=self.course_key.make_usage_key("problem", problem),
+            grade=grade, max_grade=max_grade,
+        )
+        StudentModuleHistory.objects.filter(student_module=module).delete()
+        for grade, max_grade in history:
+            StudentModuleHistory.objects.create(
+                student_module=module, created=timezone.now(), grade=grade, max_grade=max_grade
+            )
+        return module
+
+    def test_rescore(self):
+        raised = self.create_module(self.users[0], "p1", [(1, 5), (4, 5), (2, 5)])
+        best = self.create_module(self.users[1], "p1", [(1, 5), (3, 5)])
+        other_max = self.create_module(self.users[2], "p1", [(10, 10), (2, 5)])
+        results = list(iter_best_score_rescore(self.course_key, chunk_size=2))
+        self.assertEqual(sum(updated for _, updated, _ in results), 1)
+        self.assertEqual([module.id for _, _, modules in results for module in modules], [raised.id])
+        self.assertEqual(StudentModule.objects.get(id=raised.id).grade, 4)
+        self.assertEqual(get_history_grades(self.users[0], raised.module_state_key)[-1], 4)
+        self.assertEqual(StudentModule.objects.get(id=best.id).grade, 3)
+        self.assertEqual(StudentModule.objects.get(id=other_max.id).grade, 2)
+
+    def test_rescore_single_problem(self):
+        self.create_module(self.users[0], "p1", [(4, 5), (2, 5)])
+        other = self.create_module(self.users[0], "p2", [(4, 5), (2, 5)])
+        usage_key = self.course_key.make_usage_key("problem", "p1")
+        list(iter_best_score_rescore(self.course_key, usage_key=usage_key))
+        self.assertEqual(StudentModule.objects.get(id=other.id).grade, 2)
+
+
+class TestSetScoresBulk(TestCase):
+    """
+    Checks that bulk scores keep best score semantics.
+    """
+    def setUp(self):
+        super(TestSetScoresBulk, self).setUp()
+        self.users = [UserFactory.create() for _ in range(4)]
+        self.usage_key = CourseLocator("org", "course", "run").make_usage_key("problem", "p1")
+        for user, (grade, max_grade) in zip(self.users[:3], [(3, 5), (3, 5), (3, 5)]):
+            update_best_score(user.id, self.usage_key, grade, max_grade)
+
+    def get_scores(self):
+        return [
+            tuple(StudentModule.objects.filter(student=user).values_list('grade', 'max_grade').first() or ())
+            for user in self.users
+        ]
+
+    @patch.object(NpoedGradingFeatures, 'is_problem_best_score_enabled', return_value=True)
+    def test_best_score(self, is_enabled):
+        scores = [(self.users[0].id, 4, 5), (self.users[1].id, 1, 5), (self.users[2].id, 1, 10), (self.users[3].id, 2, 5)]
+        set_scores_bulk(self.usage_key, scores)
+        self.assertEqual(is_enabled.call_count, 1)
+        self.assertEqual(self.get_scores(), [(4, 5), (3, 5), (1, 10), (2, 5)])
+        # History is written for changed rows only
+        self.assertEqual(
+            [get_history_grades(user, self.usage_key) for user in self.users],
+            [[3, 4], [3], [3, 1], [2]]
+        )
+
+    @patch.object(NpoedGradingFeatures, 'is_problem_best_score_enabled', return_value=False)
+    def test_disabled(self, _):
+        set_scores_bulk(self.usage_key, [(user.id, 1, 5) for user in self.users])
+        self.assertEqual(self.get_scores(), [(1, 5)] * 4)
@@ -0,0 +1,71 @@
+import json
+
+import six
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from mock import patch
+from student.tests.factories import UserFactory
+
+from ..models import NpoedGradingFeatures, CoursePassingGradeUserStatus
+from ..reports import CSV_COLUMNS, iter_passing_grade_report, write_csv, write_jsonl
+
+
+@override_settings(NPOED_GRADING_FEATURES_SYNC_EXECUTOR="inline")
+class TestPassingGradeReport(TestCase):
+    """
+    Checks that passing grade report is streamed by chunks and written as CSV/JSONL
+    """
+    COURSE_ID = "course-v1:org+course+run"
+    RESULTS = [("Homework", 0.5, 0.2), ("Exam", 0.3, 0.4)]
+    MESSAGES = [(False, "Some translated message")]
+
+    def setUp(self):
+        super(TestPassingGradeReport, self).setUp()
+        cache.clear()
+        NpoedGradingFeatures._local_cache.clear()
+        push_patcher = patch.object(NpoedGradingFeatures, '_push_vertical_grading_to_modulestore', return_value=True)
+        push_patcher.start()
+        self.addCleanup(push_patcher.stop)
+        NpoedGradingFeatures.enable_passing_grade(self.COURSE_ID)
+        self.users = [UserFactory() for _ in range(5)]
+        for user in self.users[:4]:
+            CoursePassingGradeUserStatus.set_passing_grade_status(self.COURSE_ID, user, self.RESULTS)
+        CoursePassingGradeUserStatus.objects.create(
+            course_id=self.COURSE_ID, user=self.users[4], status_messages=self.MESSAGES
+        )
+        CoursePassingGradeUserStatus.objects.create(
+            course_id="course-v1:org+other+run", user=self.users[0], status_messages=self.MESSAGES
+        )
+
+    def test_pagination(self):
+        # Two queries (statuses, usernames) per chunk and one for the empty tail
+        with self.assertNumQueries(7):
+            records = list(iter_passing_grade_report(self.COURSE_ID, chunk_size=2))
+        self.assertEqual([x["user_id"] for x in records], [user.id for user in self.users])
+        self.assertEqual(records[0], {
+            "user_id": self.users[0].id,
+            "username": self.users[0].username,
+            "is_failed": True,
+            "categories": [
+                {"category": "Homework", "threshold": 0.5, "percent": 0.2, "failed": True},
+                {"category": "Exam", "threshold": 0.3, "percent": 0.4, "failed": False},
+            ],
+        })
+        self.assertEqual(records[4]["categories"], [{"message": "Some translated message", "failed": False}])
+
+    def test_csv(self):
+        stream = six.StringIO()
+        write_csv(iter_passing_grade_report(self.COURSE_ID), stream)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(lines[0], ",".join(CSV_COLUMNS))
+        self.assertEqual(len(lines), 1 + 4 * 2 + 1)
+        self.assertEqual(lines[1], "{},{},Homework,0.5,0.2,1".format(self.users[0].id, self.users[0].username))
+        self.assertEqual(lines[-1], "{},{},Some translated message,,,0".format(self.users[4].id, self.users[4].username))
+
+    def test_jsonl(self):
+        stream = six.StringIO()
+        write_jsonl(iter_passing_grade_report(self.COURSE_ID), stream)
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[1]["username"], self.users[1].username)
+        self.assertEqual(records[1]["categories"][0]["category"], "Homework")
@@ -1,4 +1,4 @@
-from collections import namedtuple
+from django.test import override_settings
 from openedx.core.djangolib.testing.utils import get_mock_request
 from student.tests.factories import UserFactory
 from xmodule.modulestore.tests.factories import CourseFactory, ItemFactory
@@ -7,11 +7,8 @@ from xmodule.partitions.partitions import (
 )
 
 from lms.djangoapps.grades.tests.utils import answer_problem
+from ..grading_core import GradingPolicy, course_from_tree, grade_course
 from ..models import NpoedGradingFeatures
-from ..utils import find_drop_index
-
-
-TestGrade = namedtuple('TestGrade', ["earn", "max", "weight"])
 
 
 class ContentGroupsMixin(object):
@@ -167,77 +164,17 @@ class BuildCourseMixin(object):
         self.course = self.store.get_course(self.course.id)
 
     def _grade_tree(self, tree, enable_vertical):
+        """
+        Expected course percent, computed by standalone grading core
+        """
         self.course = self.store.get_course(self.course.id)
-
-        def get_unit_problem_pairs(unit_tree):
-            all_earned, all_max = [], []
-            for _, pair in unit_tree.iteritems():
-                earned, max_ = pair
-                if not (earned is None or max_ is None):
-                    all_earned.append(float(earned))
-                    all_max.append(float(max_))
-            return all_earned, all_max
-
-        def grade_subsection(subsection_tree):
-            grades = []
-            for unit_name, unit_pair in subsection_tree.iteritems():
-                weight, unit_tree = unit_pair
-                current_earned, current_max = get_unit_problem_pairs(unit_tree)
-                if not enable_vertical:
-                    weight = 1
-                if weight and current_max:
-                    grades.append(TestGrade(sum(current_earned), sum(current_max), weight))
-
-            if enable_vertical:
-                return grades
-            subsection_grade = TestGrade(sum([x.earn for x in grades]), sum([x.max for x in grades]), 1)
-            return [subsection_grade]
-
-        def drop_minimal(grades_list):
-            pc = [x.earn/x.max for x in grades_list]
-            w = [x.weight for x in grades_list]
-            ind = find_drop_index(pc, w)
-            grades_list.pop(ind)
-
-        def weighted_score(grades_list):
-            percent = lambda x: x.earn/x.max if x.max else 0
-            top = sum([percent(g)*g.weight for g in grades_list])
-            bottom = sum([g.weight for g in grades_list])
-            if not bottom:
-                return 0
-            return top/bottom
-
-        score_by_assignment_category = {}
-        for _, section_tree in tree.iteritems():
-            for __, subsection_pair in section_tree.iteritems():
-                assignment_category, subsection_tree = subsection_pair
-                if not assignment_category:
-                    continue
-                if assignment_category not in score_by_assignment_category:
-                    score_by_assignment_category[assignment_category] = []
-                grades = grade_subsection(subsection_tree)
-                score_by_assignment_category[assignment_category].extend(grades)
-
-        course_score = 0
-        assignment_category_meta = dict(
-            ((x["type"], {"weight": x["weight"], "drop_count": x["drop_count"]})
-             for x in self.course.grading_policy["GRADER"])
-        )
-        for assignment_category in score_by_assignment_category:
-            drop_count = int(assignment_category_meta[assignment_category]["drop_count"])
-            weight = assignment_category_meta[assignment_category]["weight"]
-
-            for _ in range(drop_count):
-                drop_minimal(score_by_assignment_category[assignment_category])
-            assignment_score = weighted_score(score_by_assignment_category[assignment_category])
-            course_score += assignment_score * weight
-
-        course_score = round(course_score * 100 + 0.05) / 100
-        return course_score
+        policy = GradingPolicy(self.course.grading_policy)
+        return grade_course(course_from_tree(tree), policy, vertical_mode=enable_vertical).percent
 
     def _enable_if_needed(self, enable_vertical):
         if enable_vertical:
-            NpoedGradingFeatures.enable_vertical_grading(str(self.course.id))
+            with override_settings(NPOED_GRADING_FEATURES_SYNC_EXECUTOR="inline"):
+                NpoedGradingFeatures.enable_vertical_grading(str(self.course.id))
             # needed in tests only
             self.course.vertical_grading = True
             #self.store.update_item(self.course, 0)
@@ -1,3 +1,5 @@
+from unittest import skipIf
+
 import ddt
 from mock import patch
 from django.conf import settings
@@ -6,11 +8,17 @@ from openedx.core.djangolib.testing.utils import get_mock_request
 from lms.djangoapps.grades.new.course_grade_factory import CourseGradeFactory, CourseData
 from lms.djangoapps.grades.tests.utils import answer_problem
 
-from student.models import CourseEnrollment
+from courseware.models import StudentModule
+from student.models import CourseEnrollment, anonymous_id_for_user
 from student.tests.factories import UserFactory
+from submissions import api as submissions_api
 from xmodule.modulestore.tests.factories import CourseFactory, ItemFactory
 from xmodule.modulestore.tests.django_utils import ModuleStoreTestCase, SharedModuleStoreTestCase
 
+from ..batch_grading import BatchGrader, np
+from ..enable_vertical_grading import VerticalGrade
+from ..grading_core import course_from_tree
+from ..models import PersistentVerticalGrade
 from .test_utils import BuildCourseMixin, ContentGroupsMixin
 
 
@@ -582,4 +590,177 @@ class TestVerticalGrading(ModuleStoreTestCase, BuildCourseMixin, ContentGroupsMi
         model_calculated_pc = self._grade_tree(tree, enable_vertical)
         self.assertEqual(pc, model_calculated_pc)
         expected_pc = 0.
-        self.assertEqual(pc, expected_pc)
\ No newline at end of file
+        self.assertEqual(pc, expected_pc)
+
+    @skipIf(np is None, "numpy is not installed")
+    def test_batch_grader_matches_course_grade(self):
+        """
+        Tests that BatchGrader gives the same grade as CourseGrade with vertical grading
+        """
+        tree = {
+            "a": {
+                "b1": ("Homework", {
+                    "c1": (1., {"d1": (0., 1.), "e1": (0., 1.)}),
+                    "f1": (4., {"g1": (1., 1.), "h1": (1., 1.)}),
+                }),
+                "b2": ("Homework", {
+                    "c2": (0., {"d2": (1., 1.), "e2": (0., 1.)}),
+                    "f2": (4., {"g2": (1., 1.), "h2": (0., 1.)}),
+                }),
+                "b3": ("Exam", {
+                    "c3": (2., {"d3": (1., 1.), "e3": (1., 2.)}),
+                }),
+                "b4": (None, {
+                    "c4": (1., {"d4": (1., 1.)}),
+                }),
+            }
+        }
+        grading_policy = {
+            "GRADER": [
+                {"type": "Homework", "min_count": 3, "drop_count": 1, "short_label": "HW", "weight": 0.6},
+                {"type": "Exam", "min_count": 1, "drop_count": 0, "short_label": "Ex", "weight": 0.4},
+            ],
+            "GRADE_CUTOFFS": {"A": 0.8, "Pass": 0.5},
+        }
+        self._update_grading_policy(grading_policy)
+        self._build_from_tree(tree)
+        self._enable_if_needed(True)
+        course_grade = CourseGradeFactory().create(self.request.user, self.course)
+
+        formats, weights, earned, possible = [], [], [], []
+        for subsection in course_from_tree(tree).subsections:
+            for unit in subsection.units:
+                problems = [x for x in unit.problems if x.possible is not None]
+                formats.append(subsection.format)
+                weights.append(unit.weight)
+                earned.append(sum(x.earned for x in problems))
+                possible.append(sum(x.possible for x in problems))
+        batch = BatchGrader(grading_policy, formats, weights, passing_grade=False).grade([earned], [possible])
+        self.assertEqual(batch['percent'][0], course_grade.percent)
+        self.assertEqual(batch['letter_grade'][0], course_grade.letter_grade)
+
+
+@patch.dict(settings.FEATURES, {'PERSISTENT_GRADES_ENABLED_FOR_ALL_TESTS': False})
+class TestPersistentVerticalGrades(ModuleStoreTestCase, BuildCourseMixin):
+    """
+    Tests that vertical grades are stored and recomputed only after changes
+    """
+    TREE = {
+        "a": {
+            "b": ("Homework", {
+                "c": (2., {"d": (0., 1.), "e": (1., 1.)}),
+                "f": (1., {"g": (1., 2.)}),
+            }),
+        }
+    }
+
+    def setUp(self):
+        super(TestPersistentVerticalGrades, self).setUp()
+        self.course = CourseFactory.create()
+        self.request = get_mock_request(UserFactory())
+        self._update_grading_policy()
+        CourseEnrollment.enroll(self.request.user, self.course.id)
+        self._build_from_tree(self.TREE)
+        self._enable_if_needed(True)
+
+    def get_stored(self):
+        return PersistentVerticalGrade.read_grades(self.request.user.id, self.course.id)
+
+    def test_grades_are_stored(self):
+        pc = CourseGradeFactory().create(self.request.user, self.course).percent
+        stored = self.get_stored()
+        self.assertEqual(len(stored), 2)
+        self.assertEqual(pc, CourseGradeFactory().create(self.request.user, self.course).percent)
+        self.assertEqual(
+            dict((x.usage_key, x.modified) for x in self.get_stored().values()),
+            dict((x.usage_key, x.modified) for x in stored.values())
+        )
+
+    def test_only_changed_vertical_is_recomputed(self):
+        CourseGradeFactory().create(self.request.user, self.course).percent
+        stored = self.get_stored()
+        answer_problem(self.course, self.request, self.course_tree["d"], score=1., max_value=1.)
+        pc = CourseGradeFactory().create(self.request.user, self.course).percent
+        self.assertEqual(pc, self._grade_tree({
+            "a": {"b": ("Homework", {"c": (2., {"d": (1., 1.), "e": (1., 1.)}), "f": (1., {"g": (1., 2.)})})}
+        }, True))
+        updated = self.get_stored()
+        c_key, f_key = str(self.course_tree["c"].location), str(self.course_tree["f"].location)
+        self.assertGreater(updated[c_key].modified, stored[c_key].modified)
+        self.assertEqual(updated[c_key].earned, 2.)
+        self.assertEqual(updated[f_key].modified, stored[f_key].modified)
+
+    def test_deleted_score_invalidates_grade(self):
+        CourseGradeFactory().create(self.request.user, self.course).percent
+        StudentModule.objects.filter(
+            student=self.request.user, module_state_key=self.course_tree["e"].location
+        ).delete()
+        pc = CourseGradeFactory().create(self.request.user, self.course).percent
+        self.assertEqual(pc, self._grade_tree({
+            "a": {"b": ("Homework", {"c": (2., {"d": (0., 1.), "e": (0., 1.)}), "f": (1., {"g": (1., 2.)})})}
+        }, True))
+        self.assertEqual(self.get_stored()[str(self.course_tree["c"].location)].earned, 0.)
+
+    def test_submissions_score_invalidates_grade(self):
+        CourseGradeFactory().create(self.request.user, self.course).percent
+        stored = self.get_stored()
+        g_key = unicode(self.course_tree["g"].location)
+        submission = submissions_api.create_submission({
+            "student_id": anonymous_id_for_user(self.request.user, self.course.id),
+            "course_id": unicode(self.course.id),
+            "item_id": g_key,
+            "item_type": "problem",
+        }, "answer")
+        submissions_api.set_score(submission["uuid"], 2, 2)
+        CourseGradeFactory().create(self.request.user, self.course).percent
+        f_key = str(self.course_tree["f"].location)
+        self.assertGreater(self.get_stored()[f_key].modified, stored[f_key].modified)
+        self.assertEqual(self.get_stored()[f_key].earned, 2.)
+
+    def get_grade(self, course_grade, name):
+        grades = [grade for chapter in course_grade.chapter_grades.values() for grade in chapter['sections']]
+        return [grade for grade in grades if grade.location == self.course_tree[name].location][0]
+
+    def test_zero_weight_vertical_is_graded(self):
+        # Zero weight unit doesn't change percent, but is counted by grader
+        tree = {
+            "a": {
+                "b": ("Homework", {
+                    "h": (0., {"i": (1., 1.)}),
+                }),
+            }
+        }
+        self._build_from_tree(tree)
+        course_grade = CourseGradeFactory().create(self.request.user, self.course)
+        grade = self.get_grade(course_grade, "h")
+        self.assertEqual((grade.graded_total.earned, grade.graded_total.possible), (1., 1.))
+        self.assertEqual(grade.all_total.possible, 1.)
+
+    def test_ungraded_vertical_is_pruned(self):
+        tree = {
+            "a": {
+                "b": (None, {
+                    "h": (1., {"i": (1., 1.)}),
+                }),
+            }
+        }
+        self._build_from_tree(tree)
+        course_grade = CourseGradeFactory().create(self.request.user, self.course)
+        grade = self.get_grade(course_grade, "h")
+        self.assertEqual(grade.graded_total.possible, 0)
+        # Totals of all problems and problem scores are still available for progress page
+        self.assertEqual((grade.all_total.earned, grade.all_total.possible), (1., 1.))
+        self.assertEqual(len(grade.problem_scores), 1)
+
+    def test_vertical_grade_record(self):
+        grade = self.get_grade(CourseGradeFactory().create(self.request.user, self.course), "c")
+        self.assertIsInstance(grade, VerticalGrade)
+        self.assertFalse(hasattr(grade, '__dict__'))
+        self.assertIs(grade.graded_total, grade)
+        self.assertEqual((grade.earned, grade.possible, grade.weight, grade.format), (1., 2., 2., "Homework"))
+        self.assertEqual(len(grade.problem_scores), 2)
+        # Problem scores for progress page don't build the full grade
+        self.assertIsNone(grade._full)
+        # Other attributes are taken from edx subsection grade
+        self.assertTrue(hasattr(grade, 'course_version'))
+        self.assertEqual(grade._full.location, grade.location)